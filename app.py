@@ -1,55 +1,515 @@
-from flask import *
+from __future__ import annotations
 
-from io import BytesIO
-from zipfile import ZipFile
-from werkzeug.datastructures import FileStorage
+import time
+
+IMPORT_START: float = time.perf_counter()
 
 import os
+import json
+import importlib
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import parent_process
+
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+    send_from_directory,
+)
+from werkzeug.datastructures import FileStorage
 
-from sqlHelper import DB, init_db
+from sqlHelper import DB, JobStatus, init_db
+from ingestHelper import IngestQueue
+from serveHelper import ConcurrencyLimiter, Offloader, parseFile, encodeDF
+from metricsHelper import RequestMetrics
+from profileHelper import RequestProfiler, reportOptions
+from previewHelper import PREVIEW_ROWS, countSheets, readPreview
+from statsHelper import STATS_TOP_VALUES, sheetStats, sizeOfStats
+from cacheHelper import LRUCache, FilterCache, sizeOfFrames
 from helperMethods import (
     isAValidExt,
     isAValidFileName,
+    validateFile,
     verifyKeys,
-    readFile,
+    verifyColumns,
+    validateFilter,
+    makeETag,
+    readColumnar,
     sendDF,
+    sendEncoded,
+    negotiateMimetype,
     applyFilters,
+    parseSort,
+    filter_paths,
+    zipStream,
+)
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+# Every endpoint, registered on the app by create_app
+routes: Blueprint = Blueprint("routes", __name__)
+
+# Set up by create_app
+db: Optional[DB] = None
+workbook_cache: Optional[LRUCache] = None
+filter_cache: Optional[FilterCache] = None
+stats_cache: Optional[LRUCache] = None
+ingest_queue: Optional[IngestQueue] = None
+offload: Optional[Offloader] = None
+profiler: Optional[RequestProfiler] = None
+
+# Used by the views at import, configured by create_app
+limiter: ConcurrencyLimiter = ConcurrencyLimiter()
+metrics: RequestMetrics = RequestMetrics()
+
+startup_timings: dict = dict()  # Seconds spent per startup phase
+
+
+@contextmanager
+def startupPhase(name: str):
+    start: float = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+
+
+# Imported by warmup, in the order they depend on each other
+WARMUP_MODULES: tuple = (
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "pyarrow.parquet",
+    "openpyxl",
+    "odf.opendocument",
 )
 
-app = Flask(__name__, static_folder="static", template_folder="templates")
 
-APP_FOLDER: str = ""
-db_path: os.PathLike = init_db(parent=APP_FOLDER, db_name="files")
-db: DB = DB(db_path)  # Create a global DB instance.
+def warmup():
+    # Import the data stack and format engines ahead of the first request. Call it
+    # from the WSGI server's pre-fork hook (e.g. gunicorn's on_starting) so every
+    # worker inherits them, or set WARMUP=1 to run it in create_app.
+    for module in WARMUP_MODULES:
+        with startupPhase(f"warmup {module}"):
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                print(f"Skipped warming up {module}: {e}")
+
+
+def loadConfig(app: Flask):
+    # Read the configuration from the environment
+
+    # Requests with a larger Content-Length are rejected with 413 before being read
+    app.config["MAX_CONTENT_LENGTH"] = int(
+        os.environ.get("MAX_UPLOAD_BYTES", 1024 * 1024 * 1024)
+    )
+    app.config["APP_FOLDER"] = os.environ.get("APP_FOLDER", "")
+    app.config["UPLOAD_WORKERS"] = int(os.environ.get("UPLOAD_WORKERS", 4))
+    app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 8))
+    app.config["DB_PRAGMAS"] = {
+        pragma: os.environ[f"DB_{pragma.upper()}"]
+        for pragma in ("synchronous", "cache_size", "mmap_size", "busy_timeout")
+        if f"DB_{pragma.upper()}" in os.environ
+    }  # Override DEFAULT_PRAGMAS of sqlHelper, e.g. DB_SYNCHRONOUS=FULL
+
+    # Parsed workbooks keyed by (file id, content version), bounded by a memory budget
+    app.config["WORKBOOK_CACHE_MAX_BYTES"] = int(
+        os.environ.get("WORKBOOK_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+    )
+    # Per-filter row masks, encoded filtered columns and sort orders of range filtered
+    # or sorted columns, keyed by (file id, version, sheet, ...)
+    app.config["FILTER_MASK_CACHE_MAX_BYTES"] = int(
+        os.environ.get("FILTER_MASK_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    )
+    app.config["COLUMN_ENCODING_CACHE_MAX_BYTES"] = int(
+        os.environ.get("COLUMN_ENCODING_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+    )
+    app.config["SORT_ORDER_CACHE_MAX_BYTES"] = int(
+        os.environ.get("SORT_ORDER_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+    )
+    # Column statistics, keyed by (file id, version, sheet, column, top values)
+    app.config["COLUMN_STATS_CACHE_MAX_BYTES"] = int(
+        os.environ.get("COLUMN_STATS_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+    )
+
+    # Uploaded files are parsed in a process pool, in the background of the request
+    app.config["INGEST_WORKERS"] = int(
+        os.environ.get("INGEST_WORKERS", min(4, os.cpu_count() or 1))
+    )
+    app.config["INGEST_MAX_QUEUED"] = int(os.environ.get("INGEST_MAX_QUEUED", 1000))
+    # Seconds a parse claimed by a process lasts unless renewed, a process that died
+    # stops renewing and its parses are requeued once their lease expires
+    app.config["INGEST_LEASE"] = float(os.environ.get("INGEST_LEASE", 30))
+
+    # In the async serving mode parsing and encoding run in worker processes and
+    # independent DB queries run concurrently on a thread pool
+    app.config["SERVING_MODE"] = os.environ.get("SERVING_MODE", "sync")  # or "async"
+    app.config["OFFLOAD_THREADS"] = int(os.environ.get("OFFLOAD_THREADS", 8))
+    app.config["OFFLOAD_PROCESSES"] = int(
+        os.environ.get("OFFLOAD_PROCESSES", min(4, os.cpu_count() or 1))
+    )
+
+    # Requests running at once per endpoint class, e.g. CONCURRENCY_LIMIT_RENDER=2.
+    # Requests waiting longer than CONCURRENCY_WAIT seconds for a slot get a 503.
+    app.config["CONCURRENCY_LIMITS"] = {
+        endpoint_class: int(
+            os.environ.get(f"CONCURRENCY_LIMIT_{endpoint_class.upper()}", default)
+        )
+        for endpoint_class, default in (
+            ("metadata", 32),
+            ("render", 4),
+            ("upload", 2),
+        )
+    }
+    app.config["CONCURRENCY_WAIT"] = float(os.environ.get("CONCURRENCY_WAIT", 30))
+
+    # Cache-Control of ETag tagged responses, e.g. "private, no-cache" if shared
+    # caches shouldn't keep them
+    app.config["CACHE_CONTROL"] = os.environ.get("CACHE_CONTROL", "no-cache")
+
+    # Requests sent with "X-Profile: 1" are profiled, only if PROFILING=1
+    app.config["PROFILING"] = os.environ.get("PROFILING", "0") == "1"
+    app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", "profiles")
+    app.config["PROFILE_KEEP"] = int(os.environ.get("PROFILE_KEEP", 50))
+
+    app.config["WARMUP"] = os.environ.get("WARMUP", "0") == "1"
+
+
+def create_app(config: Optional[dict] = None) -> Flask:
+    # Build the app: read the configuration (config overrides the environment), open
+    # the database and start the background workers
+    global db, workbook_cache, filter_cache, stats_cache, ingest_queue, offload, profiler
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+
+    with startupPhase("config"):
+        loadConfig(app)
+        app.config.update(config or dict())
+
+    with startupPhase("db"):
+        db_path: os.PathLike = init_db(parent=app.config["APP_FOLDER"], db_name="files")
+        db = DB(
+            db_path,
+            pool_size=app.config["DB_POOL_SIZE"],
+            pragmas=app.config["DB_PRAGMAS"],
+        )
+
+    with startupPhase("caches"):
+        workbook_cache = LRUCache(app.config["WORKBOOK_CACHE_MAX_BYTES"], sizeOfFrames)
+        db.subscribe(workbook_cache.invalidate)  # Drop stale parses on update / delete
+        filter_cache = FilterCache(
+            app.config["FILTER_MASK_CACHE_MAX_BYTES"],
+            app.config["COLUMN_ENCODING_CACHE_MAX_BYTES"],
+            app.config["SORT_ORDER_CACHE_MAX_BYTES"],
+        )
+        db.subscribe(filter_cache.invalidate)
+        stats_cache = LRUCache(app.config["COLUMN_STATS_CACHE_MAX_BYTES"], sizeOfStats)
+        db.subscribe(stats_cache.invalidate)
+
+    with startupPhase("workers"):
+        in_worker: bool = parent_process() is not None  # A pool's worker process
+        ingest_queue = IngestQueue(
+            db,
+            app.config["INGEST_WORKERS"],
+            app.config["INGEST_MAX_QUEUED"],
+            lease=app.config["INGEST_LEASE"],
+        )
+        if not in_worker:
+            ingest_queue.start()
+
+        offload = Offloader(
+            app.config["SERVING_MODE"] == "async" and not in_worker,
+            app.config["OFFLOAD_THREADS"],
+            app.config["OFFLOAD_PROCESSES"],
+        )
+        limiter.configure(
+            app.config["CONCURRENCY_LIMITS"],
+            app.config["CONCURRENCY_WAIT"],
+        )
+
+    with startupPhase("routes"):
+        # Phase timings of every request, sent as Server-Timing and exported at /metrics
+        metrics.init_app(app)
+        db.observe_queries(lambda seconds: metrics.add("db", seconds))
+        registerGauges()
+
+        profiler = RequestProfiler(
+            app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"]
+        )
+        if app.config["PROFILING"]:
+            profiler.init_app(app)
+
+        app.register_blueprint(routes)
+
+    if app.config["WARMUP"]:
+        warmup()
+
+    print(
+        "Started in "
+        + ", ".join(
+            f"{phase} {seconds * 1000:.1f} ms"
+            for phase, seconds in startup_timings.items()
+        )
+    )
+    return app
+
+
+def registerGauges():
+    caches = lambda: (
+        ("workbooks", workbook_cache),
+        ("filter_masks", filter_cache.masks),
+        ("column_encodings", filter_cache.encodings),
+        ("sort_orders", filter_cache.orders),
+        ("column_stats", stats_cache),
+    )
+    metrics.gauge(
+        "cache_bytes",
+        "Approximate memory used by each cache",
+        lambda: [({"cache": name}, cache.stats()["bytes"]) for name, cache in caches()],
+    )
+    metrics.gauge(
+        "cache_entries",
+        "Entries held by each cache",
+        lambda: [
+            ({"cache": name}, cache.stats()["entries"]) for name, cache in caches()
+        ],
+    )
+    metrics.gauge(
+        "endpoint_class_active_requests",
+        "Requests running per endpoint class",
+        lambda: [
+            ({"class": name}, stats["active"])
+            for name, stats in limiter.stats().items()
+        ],
+    )
+    metrics.gauge(
+        "ingest_pending_files",
+        "Files queued or being parsed in the background",
+        lambda: [({}, db.count_pending_jobs())],
+    )
+    metrics.gauge(
+        "startup_phase_seconds",
+        "Time spent per startup phase, import included",
+        lambda: [
+            ({"phase": name}, seconds) for name, seconds in startup_timings.items()
+        ],
+    )
+
+
+def loadWorkbook(file_id: int, version: int) -> Optional[dict]:
+    # Return the parsed sheets of a file, parsing the blob only on a cache miss
+    key = (int(file_id), int(version))
+    sheets: dict = workbook_cache.get(key)
+    if sheets is not None:
+        return sheets
+
+    file: FileStorage = db.get_file(file_id)
+    if not file:
+        return None
+
+    with metrics.phase("parse"):
+        sheets = offload.cpu(parseFile, file.stream, file.filename)
+    if sheets is not None:
+        workbook_cache.put(key, sheets)
+
+    return sheets
+
+
+def loadSheet(
+    file_id: int, version: int, sheet: int, columns: Optional[list] = None
+) -> Optional[DataFrame]:
+    # Return a single sheet, preferring its columnar copy over re-parsing the workbook.
+    # If columns (0-based positions) are given only those are read, in that order.
+    key = (int(file_id), int(version), int(sheet))
+    if columns is None:
+        df: DataFrame = workbook_cache.get(key)
+        if df is not None:
+            return df
+
+    data: bytes = db.get_sheet_data(file_id, sheet)
+    if data is not None:
+        if columns is None:
+            with metrics.phase("parse"):
+                df = readColumnar(data)
+            workbook_cache.put(key, df)
+            return df
+
+        names: list = db.get_column_names(file_id, sheet)
+        with metrics.phase("parse"):
+            return readColumnar(data, [names[column] for column in columns])
+
+    # No columnar copy (e.g. uploaded before they existed), fall back to the original
+    sheets: dict = loadWorkbook(file_id, version)
+    if not sheets or not 0 <= sheet < len(sheets):
+        return None
+
+    df = list(sheets.values())[sheet]
+    return df if columns is None else df.iloc[:, columns]
+
+
+def loadStats(
+    file_id: int, version: int, sheet: int, columns: list, top: int
+) -> Optional[list]:
+    # Statistics of the given sheet columns, reading and counting only uncached ones
+    keys: dict = {column: (file_id, version, sheet, column, top) for column in columns}
+    stats: dict = {column: stats_cache.get(key) for column, key in keys.items()}
+    missing: list = sorted(column for column, entry in stats.items() if entry is None)
+    if missing:
+        df: DataFrame = loadSheet(file_id, version, sheet, missing)
+        if df is None:
+            return None
+
+        with metrics.phase("stats"):
+            for entry in sheetStats(df, missing, top):
+                stats[entry["column"]] = entry
+                stats_cache.put(keys[entry["column"]], entry)
+
+    return [stats[column] for column in columns]
+
+
+def isParsed(file_id: int, version: int, sheet: int) -> bool:
+    # Whether the whole sheet can be served without parsing the workbook first
+    return (
+        workbook_cache.contains((file_id, version, sheet))
+        or workbook_cache.contains((file_id, version))
+        or db.get_sheet_count(file_id) is not None
+    )
+
+
+def loadPreview(file_id: int, sheet: int, rows: int) -> Optional[DataFrame]:
+    # Stream only the first rows of a sheet out of the stored file
+    file: FileStorage = db.get_file(file_id)
+    if not file:
+        return None
+
+    with metrics.phase("parse"):
+        return offload.cpu(readPreview, file.stream, file.filename, sheet, rows)
+
+
+def queueIngest(file_id: int) -> Optional[int]:
+    # Make sure a file's full parse is under way, return the id of its job.
+    # None if the queue is full, the next full request then parses it itself.
+    job_id: Optional[int] = db.get_pending_job(file_id)
+    if job_id is None and ingest_queue.has_room(1):
+        job_id = ingest_queue.submit([file_id])
+    return job_id
+
+
+def renderDF(df: DataFrame, mimetype: str) -> Response:
+    # Encode a sheet into the response, in a worker process in the async mode
+    if not offload.enabled:
+        with metrics.phase("serialize"):  # Only the first chunk, the rest is streamed
+            return sendDF(df, mimetype)
+
+    try:
+        with metrics.phase("serialize"):
+            data: bytes = offload.cpu(encodeDF, df, mimetype)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return sendEncoded(data, mimetype)
+
+
+def loadSheetCount(file_id: int) -> Optional[int]:
+    # Count the sheets of a stored file from its index, without parsing them
+    file: FileStorage = db.get_file(file_id)
+    if not file:
+        return None
+
+    with metrics.phase("parse"):
+        return offload.cpu(countSheets, file.stream, file.filename)
+
+
+def ingestPending(job_id: Optional[int]):
+    # 202 while a file is being parsed in the background, 503 if it couldn't be queued
+    if job_id is None:
+        return ingest_queue_full()
+    return jsonify({"pending": True, "jobId": job_id}), 202
+
+
+def requestData():
+    # Parameters of a request, from the query string of GET variants of POST endpoints
+    if request.method == "GET":
+        return request.args
+    return request.get_json()
+
+
+def notModified(etag: str, vary: tuple = ()) -> Optional[Response]:
+    # 304 if the client's cached copy (If-None-Match) is still current. It carries
+    # the same Vary as the full response, so caches pick the right variant.
+    if not request.if_none_match.contains(etag):
+        return None
+    return tagResponse(Response(status=304), etag, vary)
+
+
+def tagResponse(response, etag: str, vary: tuple = ()):
+    # Clients may cache the response, but must revalidate it on every use
+    if isinstance(response, Response):
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = current_app.config["CACHE_CONTROL"]
+        for header in vary:
+            response.vary.add(header)
+    return response
+
+
+@routes.app_errorhandler(413)
+def upload_too_large(e):
+    limit: int = current_app.config["MAX_CONTENT_LENGTH"]
+    return jsonify({"error": f"Upload exceeds the limit of {limit} bytes"}), 413
+
+
+def ingest_queue_full():
+    limit: int = current_app.config["INGEST_MAX_QUEUED"]
+    return (
+        jsonify({"error": f"Too many files waiting to be parsed (limit {limit})"}),
+        503,
+        {"Retry-After": "5"},
+    )
+
+
+@routes.before_app_request
+def reject_large_uploads():
+    # Reject on the declared Content-Length, before any of the body is read
+    limit: int = current_app.config["MAX_CONTENT_LENGTH"]
+    if limit is not None and (request.content_length or 0) > limit:
+        return upload_too_large(None)
 
 
 class static_servers:
     # Serving methods
-    @app.route("/", methods=["GET"])
+    @routes.route("/", methods=["GET"])
     def index():
         return render_template("main/index.html")
 
-    @app.route("/resources/<path:path>", methods=["GET"])
+    @routes.route("/resources/<path:path>", methods=["GET"])
     def get_resource(path):
         # Serve static files from back-end
         return send_from_directory("static", path)
 
-    @app.route("/scripts/<path:path>", methods=["GET"])
+    @routes.route("/scripts/<path:path>", methods=["GET"])
     def get_scripts(path):
         # Serve static files from back-end
         return send_from_directory("static/javascripts", path)
 
-    @app.route("/styles/<path:path>", methods=["GET"])
+    @routes.route("/styles/<path:path>", methods=["GET"])
     def get_styles(path):
         # Serve static files from back-end
         return send_from_directory("static/styles", path)
 
-    @app.route("/images/<path:path>", methods=["GET"])
+    @routes.route("/images/<path:path>", methods=["GET"])
     def get_images(path):
         # Serve static files from back-end
         return send_from_directory("static/images", path)
 
-    @app.route("/templates/<path:template>", methods=["GET"])
+    @routes.route("/templates/<path:template>", methods=["GET"])
     def get_template(template):
         # Serve template files from back-end
         return render_template(template)
@@ -57,7 +517,8 @@ class static_servers:
 
 class file_management:
     # Methods to manage files
-    @app.route("/files/validate", methods=["POST"])
+    @routes.route("/files/validate", methods=["POST"])
+    @limiter.limit("metadata")
     def validate_files():
         try:
             file_blobs: list = list(request.files.values())
@@ -71,7 +532,8 @@ class file_management:
         data = {"acceptedIndices": passed}
         return jsonify(data), 200
 
-    @app.route("/files/upload", methods=["POST"])
+    @routes.route("/files/upload", methods=["POST"])
+    @limiter.limit("upload")
     def upload_file():
         global db
         # Save files into database.
@@ -80,21 +542,47 @@ class file_management:
         except Exception as e:
             return jsonify({"error": "Failed to retrieve files from form"}), 500
 
-        file_statuses: list = list()
-        for file in files:
-            ok, msg, id = db.add_file(file.filename, file)
+        # Validate every file in parallel, then store the accepted ones in one transaction
+        with ThreadPoolExecutor(
+            max_workers=current_app.config["UPLOAD_WORKERS"]
+        ) as pool:
+            checks: list = list(pool.map(validateFile, files))
+
+        accepted: list = [file for file, (ok, _) in zip(files, checks) if ok]
+        if not ingest_queue.has_room(len(accepted)):
+            return ingest_queue_full()
+
+        stored = iter(db.add_files(accepted, current_app.config["UPLOAD_WORKERS"]))
+
+        results: list = list()
+        for file, (valid, msg) in zip(files, checks):
+            ok, id = False, None
+            if valid:
+                ok, msg, id = next(stored)
             print(msg)
-            file_statuses.append((ok, id))
+            results.append(
+                {"filename": file.filename, "ok": ok, "id": id, "message": msg}
+            )
+
+        succeeded_ids: list = [result["id"] for result in results if result["ok"]]
+        job_id: Optional[int] = (
+            ingest_queue.submit(succeeded_ids) if succeeded_ids else None
+        )
 
-        succeeded_ids: list = [id for ok, id in file_statuses if ok]
         return (
             jsonify(
-                {"message": "Files uploaded successfully", "passed": succeeded_ids}
+                {
+                    "message": "Files uploaded successfully",
+                    "passed": succeeded_ids,
+                    "results": results,
+                    "jobId": job_id,
+                }
             ),
             200,
         )
 
-    @app.route("/files/update", methods=["POST"])
+    @routes.route("/files/update", methods=["POST"])
+    @limiter.limit("upload")
     def update_file():
         global db
         # Update files at the given ids.
@@ -104,15 +592,21 @@ class file_management:
         except Exception as e:
             return jsonify({"error": "Failed to retrieve files from form"}), 500
 
+        if not ingest_queue.has_room(len(file_blobs)):
+            return ingest_queue_full()
+
         files = zip(file_blobs, indices)
         file_statuses: list = list()
         for file, file_id in files:
-            ok, msg, id = db.update_file(file_id, file.filename, file)
+            ok, msg = db.update_file(file_id, file.filename, file)
             print(msg)
-            file_statuses((ok, id))
+            file_statuses.append((ok, file_id))
 
         succeeded_ids: list = [id for ok, id in file_statuses if ok]
         failed_ids: list = [id for ok, id in file_statuses if not ok]
+        job_id: Optional[int] = (
+            ingest_queue.submit(succeeded_ids) if succeeded_ids else None
+        )
 
         return (
             jsonify(
@@ -120,12 +614,14 @@ class file_management:
                     "message": "Files updated successfully",
                     "passed": succeeded_ids,
                     "failed": failed_ids,
+                    "jobId": job_id,
                 }
             ),
             200,
         )
 
-    @app.route("/files/update/name/validate", methods=["POST"])
+    @routes.route("/files/update/name/validate", methods=["POST"])
+    @limiter.limit("metadata")
     def validate_file_name():
         # Update files at the given ids.
         keys = {"filename"}
@@ -146,7 +642,8 @@ class file_management:
 
         return jsonify({"error": "Invalid name"}), 500
 
-    @app.route("/files/update/name", methods=["POST"])
+    @routes.route("/files/update/name", methods=["POST"])
+    @limiter.limit("metadata")
     def update_file_name():
         global db
         # Update files at the given ids.
@@ -164,7 +661,8 @@ class file_management:
 
         return jsonify({"error": msg}), 500
 
-    @app.route("/files/delete", methods=["POST"])
+    @routes.route("/files/delete", methods=["POST"])
+    @limiter.limit("metadata")
     def delete_file():
         global db
         # Delete the file at the given id
@@ -182,7 +680,8 @@ class file_management:
 
         return jsonify({"error": msg}), 500
 
-    @app.route("/files/delete/all", methods=["POST"])
+    @routes.route("/files/delete/all", methods=["POST"])
+    @limiter.limit("metadata")
     def delete_files_from_session():
         # Delete all files from session (TODO: instead of all, delete only related to session)
         global db
@@ -195,33 +694,42 @@ class file_management:
 
 class file_fetching:
     # Methods to fetch file data
-    @app.route("/files/get/download", methods=["POST"])
+    @routes.route("/files/get/download", methods=["GET", "POST"])
+    @limiter.limit("render")
     def download_file():
         global db
         # Download a file matching given id
         keys = {"fileId"}
 
-        json_data = request.get_json()
+        json_data = requestData()
         if not verifyKeys(json_data, keys):
             return jsonify({"error": "Missing one or more required keys"}), 400
 
         file_id: int = int(json_data["fileId"])
-        file: FileStorage = db.get_file(file_id=file_id)
+        size, hash = offload.gather(
+            lambda: db.get_file_size(file_id), lambda: db.get_file_hash(file_id)
+        )
 
-        if not file:
+        if size is None:
             return jsonify({"error": "No files found"}), 500
 
-        file = BytesIO(file.stream)  # Convert to BytesIO object
-        file.seek(0)  # Point to start of file
+        etag: str = makeETag("download", hash)
+        cached: Optional[Response] = notModified(etag)
+        if cached is not None:
+            return cached
 
-        return send_file(
-            file,
-            as_attachment=True,
-            download_name="excel_file",
+        response = Response(
+            db.iter_file(file_id),  # Read from the database chunk by chunk
             mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={
+                "Content-Disposition": "attachment; filename=excel_file",
+                "Content-Length": str(size),
+            },
         )
+        return tagResponse(response, etag)
 
-    @app.route("/files/get/name", methods=["POST"])
+    @routes.route("/files/get/name", methods=["POST"])
+    @limiter.limit("metadata")
     def get_file_name():
         global db
         # Get a file name matching given id
@@ -242,39 +750,242 @@ class file_fetching:
             {"message": "Fetched filename successfully", "name": name, "ext": ext}
         )
 
-    @app.route("/files/get/sheet", methods=["POST"])
+    @routes.route("/files/get/names", methods=["POST"])
+    @limiter.limit("metadata")
+    def get_file_names():
+        global db
+        # Get name, ext and size of many files at once, all files if fileIds is missing
+        json_data = request.get_json(silent=True) or {}
+        file_ids: Optional[list] = json_data.get("fileIds")
+
+        files: list = db.get_files_info(file_ids)
+        return (
+            jsonify({"message": "Fetched file names successfully", "files": files}),
+            200,
+        )
+
+    @routes.route("/files/get/sheet", methods=["GET", "POST"])
+    @limiter.limit("render")
     def get_sheet():
         global db
         # Get a sheet matching given id and sheet
         keys = {"fileId", "sheet"}
 
-        json_data = request.get_json()
+        json_data = requestData()
         if not verifyKeys(json_data, keys):
             return jsonify({"error": "Missing one or more required keys"}), 400
 
         file_id: int = int(json_data["fileId"])
         sheet: int = int(json_data["sheet"])
+        # Rows of a preview sent while the sheet isn't parsed yet, "true" for the default
+        preview: Optional[str] = json_data.get("preview")
+        try:
+            sort: list = parseSort(json_data.get("sort"))
+        except (ValueError, KeyError, TypeError):
+            return jsonify({"error": "Invalid sort"}), 400
+
+        version, hash, filters = offload.gather(
+            lambda: db.get_file_version(file_id),
+            lambda: db.get_file_hash(file_id),
+            lambda: db.get_sheets_filters(file_id, sheet),
+        )
+
+        if version is None:
+            return jsonify({"error": "No files found"}), 500
+
+        mimetype: str = negotiateMimetype(request.accept_mimetypes)
+        if preview is not None and not isParsed(file_id, version, sheet):
+            rows: int = int(preview) if str(preview).isdigit() else PREVIEW_ROWS
+            df = loadPreview(file_id, sheet, rows)
+            if df is None:
+                return jsonify({"error": "No sheets found in file"}), 200
+            if not verifyColumns((column for column, _ in sort), df.shape[1]):
+                return jsonify({"error": "Column out of range"}), 400
+
+            if filters or sort:
+                # Not cached, only a part of the sheet
+                with metrics.phase("filter"):
+                    try:
+                        df = applyFilters(df, filters, sort=sort)
+                    except (ValueError, IndexError) as e:
+                        return jsonify({"error": str(e)}), 400
+
+            # The rest is parsed in the background, the client fetches it again once
+            # the job is done. Incomplete bodies must not be cached.
+            response = renderDF(df, mimetype)
+            if isinstance(response, Response):
+                response.headers["X-Preview"] = "incomplete"
+                response.headers["Cache-Control"] = "no-store"
+                job_id: Optional[int] = queueIngest(file_id)
+                if job_id is not None:
+                    response.headers["X-Job-Id"] = str(job_id)
+            return response
+
+        # Same contents, sheet, active filters, sort and format give the same body
+        active: list = sorted(
+            ((f["column"], f["method"], f["input"]) for f in filters if f["enabled"]),
+            key=str,
+        )
+        etag: str = makeETag("sheet", hash, version, sheet, active, sort, mimetype)
+        cached: Optional[Response] = notModified(etag, vary=("Accept",))
+        if cached is not None:
+            return cached
+
+        df: DataFrame = loadSheet(file_id, version, sheet)
 
-        file: FileStorage = db.get_file(file_id)
+        if df is None:
+            return jsonify({"error": "No sheets found in file"}), 200  # File is empty
+
+        if not verifyColumns((column for column, _ in sort), df.shape[1]):
+            return jsonify({"error": "Column out of range"}), 400
+
+        if filters or sort:
+            # Only if not empty or None
+            key: tuple = (file_id, version, sheet)
+            with metrics.phase("filter"):
+                try:
+                    df = applyFilters(df, filters, filter_cache, key, sort=sort)
+                except (ValueError, IndexError) as e:
+                    return jsonify({"error": str(e)}), 400
+
+        response = tagResponse(renderDF(df, mimetype), etag, vary=("Accept",))
+        if isinstance(response, Response):
+            if preview is not None:
+                response.headers["X-Preview"] = "complete"
+        return response
+
+    @routes.route("/files/get/sheet/window", methods=["POST"])
+    @limiter.limit("render")
+    def get_sheet_window():
+        global db
+        # Get a window of rows of a filtered and sorted sheet, optionally only some columns
+        keys = {"fileId", "sheet", "offset", "limit"}
 
-        if not file:
+        json_data = request.get_json()
+        if not verifyKeys(json_data, keys):
+            return jsonify({"error": "Missing one or more required keys"}), 400
+
+        file_id: int = int(json_data["fileId"])
+        sheet: int = int(json_data["sheet"])
+        offset: int = max(0, int(json_data["offset"]))
+        limit: int = max(0, int(json_data["limit"]))
+        columns: Optional[list] = json_data.get("columns")  # 0-based, None for all
+        try:
+            sort: list = parseSort(json_data.get("sort"))
+        except (ValueError, KeyError, TypeError):
+            return jsonify({"error": "Invalid sort"}), 400
+
+        version, filters, names = offload.gather(
+            lambda: db.get_file_version(file_id),
+            lambda: db.get_sheets_filters(file_id, sheet),
+            lambda: db.get_column_names(file_id, sheet),
+        )
+
+        if version is None:
             return jsonify({"error": "No files found"}), 500
 
-        sheets: dict = readFile(file)
+        if names is None:
+            # Not cataloged yet, the columns are only known once the sheet is parsed
+            df: DataFrame = loadSheet(file_id, version, sheet)
+            if df is None:
+                return jsonify({"error": "No sheets found in file"}), 200
+            names = list(df.columns)
+
+        if columns is not None:
+            columns = [int(column) for column in columns]
+        shown: list = list(range(len(names))) if columns is None else columns
+        if not verifyColumns([*shown, *(column for column, _ in sort)], len(names)):
+            return jsonify({"error": "Column out of range"}), 400
+
+        filters = [f for f in filters if f["enabled"]]
+
+        needed: Optional[list] = None
+        if columns is not None:
+            # Filtered and sorted columns must be loaded too, even if they aren't shown
+            needed = sorted(
+                set(columns)
+                | {f["column"] for f in filters}
+                | {column for column, _ in sort}
+            )
+
+        df = loadSheet(file_id, version, sheet, needed)
 
-        if not sheets:
+        if df is None:
             return jsonify({"error": "No sheets found in file"}), 200  # File is empty
 
-        sheets: list = list(sheets.values())
-        df = sheets[sheet]
+        if filters or sort:
+            key: tuple = (file_id, version, sheet)
+            with metrics.phase("filter"):
+                try:
+                    df = applyFilters(df, filters, filter_cache, key, needed, sort)
+                except (ValueError, IndexError) as e:
+                    return jsonify({"error": str(e)}), 400
+
+        window: DataFrame = df.iloc[offset : offset + limit]
+        if columns is not None:
+            window = window.iloc[:, [needed.index(column) for column in columns]]
+
+        return (
+            jsonify(
+                {
+                    "total": len(df),
+                    "offset": offset,
+                    "columns": [str(column) for column in window.columns],
+                    "rows": json.loads(
+                        window.to_json(orient="values", date_format="iso")
+                    ),
+                }
+            ),
+            200,
+        )
+
+    @routes.route("/files/get/sheet/stats", methods=["POST"])
+    @limiter.limit("render")
+    def get_sheet_stats():
+        global db
+        # Get null counts, the most frequent values and the value range of a sheet's
+        # columns, optionally only some columns (0-based), to suggest filter inputs
+        keys = {"fileId", "sheet"}
+
+        json_data = request.get_json()
+        if not verifyKeys(json_data, keys):
+            return jsonify({"error": "Missing one or more required keys"}), 400
+
+        file_id: int = int(json_data["fileId"])
+        sheet: int = int(json_data["sheet"])
+        columns: Optional[list] = json_data.get("columns")  # None for all
+        top: int = max(0, int(json_data.get("top", STATS_TOP_VALUES)))
+
+        version, names = offload.gather(
+            lambda: db.get_file_version(file_id),
+            lambda: db.get_column_names(file_id, sheet),
+        )
+
+        if version is None:
+            return jsonify({"error": "No files found"}), 500
+
+        if names is None:
+            # Not cataloged yet, the columns are only known once the sheet is parsed
+            df: DataFrame = loadSheet(file_id, version, sheet)
+            if df is None:
+                return jsonify({"error": "No sheets found in file"}), 200
+            names = list(df.columns)
 
-        filters: list = db.get_sheets_filters(file_id, sheet)
-        if filters:
-            df = applyFilters(df, filters)  # Only if not empty or None
+        if columns is None:
+            columns = list(range(len(names)))
+        columns = [int(column) for column in columns]
+        if not verifyColumns(columns, len(names)):
+            return jsonify({"error": "Column out of range"}), 400
 
-        return sendDF(df)
+        stats: Optional[list] = loadStats(file_id, version, sheet, columns, top)
 
-    @app.route("/files/get/sheet_count", methods=["POST"])
+        if stats is None:
+            return jsonify({"error": "No sheets found in file"}), 200
+
+        return jsonify({"columns": stats}), 200
+
+    @routes.route("/files/get/sheet_count", methods=["POST"])
+    @limiter.limit("render")
     def get_sheet_count():
         global db
         # Get a sheet matching given id and sheet
@@ -285,17 +996,47 @@ class file_fetching:
             return jsonify({"error": "Missing one or more required keys"}), 400
 
         file_id: int = int(json_data["fileId"])
-        file: FileStorage = db.get_file(file_id)
+        sheet_count: int = db.get_sheet_count(file_id)
+        if sheet_count is not None:
+            return jsonify({"sheets": sheet_count}), 200
 
-        if not file:
+        # Not cataloged yet: the parse runs in the background, the sheets are only
+        # counted from the file's index so the client can open a preview meanwhile
+        if db.get_file_version(file_id) is None:
             return jsonify({"error": "No files found"}), 500
 
-        sheets: dict = readFile(file)
-        sheet_count: int = len(sheets)
+        job_id: Optional[int] = queueIngest(file_id)
+        sheet_count = loadSheetCount(file_id)
+        if sheet_count is None:
+            return ingestPending(job_id)
 
-        return jsonify({"sheets": sheet_count}), 200
+        return jsonify({"sheets": sheet_count, "jobId": job_id}), 200
 
-    @app.route("/files/get/all", methods=["GET"])
+    @routes.route("/files/get/schema", methods=["POST"])
+    @limiter.limit("metadata")
+    def get_schema():
+        global db
+        # Get sheet names, row counts, column names and dtypes of a file
+        keys = {"fileId"}
+
+        json_data = request.get_json()
+        if not verifyKeys(json_data, keys):
+            return jsonify({"error": "Missing one or more required keys"}), 400
+
+        file_id: int = int(json_data["fileId"])
+        schema: list = db.get_schema(file_id)
+
+        if schema is None:
+            if db.get_file_version(file_id) is None:
+                return jsonify({"error": "No files found"}), 500
+
+            # Known once the background parse cataloged the file
+            return ingestPending(queueIngest(file_id))
+
+        return jsonify({"sheets": schema}), 200
+
+    @routes.route("/files/get/all", methods=["GET"])
+    @limiter.limit("metadata")
     def get_all_files():
         global db
         # Get all files
@@ -306,36 +1047,32 @@ class file_fetching:
 
         return jsonify(files)
 
-    @app.route("/files/get/all/compressed", methods=["GET"])
+    @routes.route("/files/get/all/compressed", methods=["GET"])
+    @limiter.limit("render")
     def get_all_files_zipped():
         global db
         # Get all files in a zip file
-        files = db.get_all_files()
+        files = db.get_files_info()
 
         if not files:
             return jsonify({"error": "No files found"}), 500
 
-        # Construct a zip archive containing all files
-        zip_data = BytesIO()
-        with ZipFile(zip_data, "w") as zip_file:
-            for file in files:
-                zip_file.writestr(f"{file['name']}{file['ext']}", file["blob"])
-
-        # Reset the file-like object's position to the beginning
-        zip_data.seek(0)
+        # Stream a zip archive containing all files, reading one blob chunk at a time
+        entries = (
+            (f"{file['name']}{file['ext']}", db.iter_file(file["id"])) for file in files
+        )
 
-        # Send the zip file to the client
-        return send_file(
-            zip_data,
-            as_attachment=True,
-            download_name="files.zip",
+        return Response(
+            zipStream(entries),
             mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=files.zip"},
         )
 
 
 class filter_management:
     # Filter management
-    @app.route("/filters/add", methods=["POST"])
+    @routes.route("/filters/add", methods=["POST"])
+    @limiter.limit("metadata")
     def add_filter():
         global db
         # Add a filter to the matching fileId
@@ -354,6 +1091,12 @@ class filter_management:
             json_data["enabled"],
         )
 
+        error: Optional[str] = validateFilter(
+            method, input, db.get_column_dtype(file_id, sheet, column)
+        )
+        if error is not None:
+            return jsonify({"error": error}), 400
+
         isOk, msg, filter_id = db.add_filter(method, input, enabled)
 
         # Check if added successfully
@@ -367,7 +1110,8 @@ class filter_management:
 
         return jsonify({"error": msg}), 500
 
-    @app.route("/filters/update", methods=["POST"])
+    @routes.route("/filters/update", methods=["POST"])
+    @limiter.limit("metadata")
     def update_filter():
         global db
         # Update a filter matching the given id.
@@ -383,6 +1127,13 @@ class filter_management:
             json_data["input"],
             json_data["enabled"],
         )
+
+        error: Optional[str] = validateFilter(
+            method, input, db.get_filter_dtype(filter_id)
+        )
+        if error is not None:
+            return jsonify({"error": error}), 400
+
         isOk, msg = db.update_filter(filter_id, method, input, enabled)
 
         if isOk:
@@ -390,7 +1141,8 @@ class filter_management:
 
         return jsonify({"error": msg}), 200
 
-    @app.route("/filters/delete", methods=["POST"])
+    @routes.route("/filters/delete", methods=["POST"])
+    @limiter.limit("metadata")
     def delete_filter():
         global db
         # Delete a filter matching the given id.
@@ -411,7 +1163,8 @@ class filter_management:
 
 class filter_fetching:
     # Fetching filter data
-    @app.route("/filters/get", methods=["POST"])
+    @routes.route("/filters/get", methods=["POST"])
+    @limiter.limit("metadata")
     def get_filter():
         global db
         # Return the filter matching given id as a json
@@ -429,7 +1182,8 @@ class filter_fetching:
 
         return filter_json, 200
 
-    @app.route("/filters/get/at", methods=["POST"])
+    @routes.route("/filters/get/at", methods=["POST"])
+    @limiter.limit("metadata")
     def get_filters_at():
         global db
         # Return all the filters of the given fileId and sheet
@@ -450,7 +1204,125 @@ class filter_fetching:
 
         return filters_json, 200
 
+    @routes.route("/filters/get/sheet", methods=["POST"])
+    @limiter.limit("metadata")
+    def get_sheet_filters():
+        global db
+        # Return all the filters of the given fileId and sheet, grouped by column
+        keys = {"fileId", "sheet"}
+
+        json_data = request.get_json()
+        if not verifyKeys(json_data, keys):
+            return jsonify({"error": "Missing one or more required keys"}), 400
+
+        file_id = json_data["fileId"]
+        sheet = json_data["sheet"]
+
+        filters: dict = db.get_sheet_filters_by_column(file_id, sheet)
+        return jsonify({"columns": filters}), 200
+
+
+class job_fetching:
+    # Methods to follow background jobs
+    @routes.route("/jobs/status", methods=["POST"])
+    @limiter.limit("metadata")
+    def get_job_status():
+        global db
+        # Get the parsing status of every file of a job
+        keys = {"jobId"}
+
+        json_data = request.get_json()
+        if not verifyKeys(json_data, keys):
+            return jsonify({"error": "Missing one or more required keys"}), 400
+
+        files: Optional[list] = db.get_job(json_data["jobId"])
+
+        if files is None:
+            return jsonify({"error": "No jobs found"}), 500
+
+        pending: tuple = (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+        return (
+            jsonify(
+                {
+                    "done": not any(file["status"] in pending for file in files),
+                    "files": files,
+                }
+            ),
+            200,
+        )
+
+
+class diagnostics:
+    # Runtime statistics
+    @routes.route("/cache/stats", methods=["GET"])
+    @limiter.limit("metadata")
+    def get_cache_stats():
+        global workbook_cache, filter_cache, stats_cache
+        # Return hit / miss counters and memory usage of the caches, and how many
+        # filter predicates ran on dictionary encoded vs row-wise column values vs sort
+        # orders, and the requests running or rejected per endpoint class
+        return (
+            jsonify(
+                {
+                    "workbooks": workbook_cache.stats(),
+                    "filters": filter_cache.stats(),
+                    "columnStats": stats_cache.stats(),
+                    "filterPaths": dict(filter_paths),
+                    "concurrency": limiter.stats(),
+                }
+            ),
+            200,
+        )
+
+    @routes.route("/metrics", methods=["GET"])
+    def get_metrics():
+        global metrics
+        # Latency histograms per endpoint and phase, cache and in-flight gauges
+        return Response(
+            metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+class profiling:
+    # Methods to inspect saved request profiles
+    @routes.route("/profiles", methods=["GET"])
+    def get_profiles():
+        global profiler
+        # List saved profiles, newest first
+        if not current_app.config["PROFILING"]:
+            return jsonify({"error": "Profiling is disabled"}), 404
+
+        return jsonify({"profiles": profiler.list()}), 200
+
+    @routes.route("/profiles/<name>", methods=["GET"])
+    def get_profile(name):
+        global profiler
+        # Fetch a profile as a pstats dump, or as a report with ?format=text
+        # (optionally ?sort=tottime&limit=100&match=helperMethods)
+        if not current_app.config["PROFILING"]:
+            return jsonify({"error": "Profiling is disabled"}), 404
+
+        path: Optional[str] = profiler.path(name)
+        if path is None:
+            return jsonify({"error": "No profiles found"}), 404
+
+        if request.args.get("format") != "text":
+            return send_file(path, as_attachment=True)
+
+        try:
+            sort, limit, match = reportOptions(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        report: str = profiler.text(name, sort, limit, match)
+        return Response(report, mimetype="text/plain")
+
+
+startup_timings["import"] = time.perf_counter() - IMPORT_START
+
 
+# WSGI servers build the app with the factory, e.g. gunicorn "app:create_app()"
 if __name__ == "__main__":
     port = 5000
-    app.run(port=port, debug=True)
+    app: Flask = create_app()
+    app.run(port=port, debug=True, threaded=True)
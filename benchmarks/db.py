@@ -0,0 +1,79 @@
+# Compare request latency of cheap DB-bound endpoints with and without the
+# connection pool / WAL pragmas.
+# Usage: python benchmarks/db.py [requests]
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.chdir(tempfile.mkdtemp())  # app.py creates its database in the working directory
+import app  # noqa: E402
+from sqlHelper import DB  # noqa: E402
+
+# Behaves like the original DB class: a new connection per call, rollback journal
+UNPOOLED = {
+    "pool_size": 0,
+    "pragmas": {"journal_mode": "DELETE", "synchronous": "FULL"},
+}
+POOLED = {"pool_size": 8, "pragmas": {}}
+
+
+def seed(client) -> tuple[int, int]:
+    # One file with a few filters on its first column
+    from io import BytesIO
+
+    response = client.post(
+        "/files/upload", data={"file": (BytesIO(b"a,b\n1,2\n"), "bench.csv")}
+    )
+    file_id: int = response.get_json()["passed"][0]
+    job_id: int = response.get_json()["jobId"]
+    while not client.post("/jobs/status", json={"jobId": job_id}).get_json()["done"]:
+        time.sleep(0.05)  # Let the background parse finish before the DB is swapped
+    for index in range(5):
+        client.post(
+            "/filters/add",
+            json={
+                "fileId": file_id,
+                "sheet": 0,
+                "column": 0,
+                "method": "contains",
+                "input": str(index),
+                "enabled": True,
+            },
+        )
+    return file_id, 0
+
+
+def timeEndpoint(client, url: str, json: dict, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.post(url, json=json)
+    return (time.perf_counter() - start) / requests * 1e6  # Microseconds
+
+
+def main(requests: int):
+    client = app.create_app().test_client()
+    file_id, column = seed(client)
+    app.ingest_queue.stop()  # It would keep using the DB swapped out below
+    endpoints = {
+        "/filters/get/at": {"fileId": file_id, "sheet": 0, "column": column},
+        "/files/get/name": {"fileId": file_id},
+    }
+
+    print(f"{'endpoint':<20}{'unpooled us':>14}{'pooled us':>14}{'speedup':>10}")
+    for url, json in endpoints.items():
+        results = []
+        for options in (UNPOOLED, POOLED):
+            app.db.close()
+            app.db = DB(app.db.db_path, **options)
+            results.append(timeEndpoint(client, url, json, requests))
+
+        unpooled, pooled = results
+        print(f"{url:<20}{unpooled:>14.1f}{pooled:>14.1f}{unpooled / pooled:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,58 @@
+# Compare encode time and payload size of every sheet response format
+# Usage: python benchmarks/serializers.py [rows]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helperMethods import encoders, toColumnar  # noqa: E402
+
+
+def syntheticSheet(rows: int) -> pd.DataFrame:
+    # Mixed dtypes resembling a typical report sheet
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "status": rng.choice(["open", "closed", "pending"], rows),
+            "region": rng.choice([f"region {i}" for i in range(50)], rows),
+            "amount": rng.random(rows) * 1000,
+            "quantity": rng.integers(0, 500, rows),
+            "date": pd.Timestamp("2024-01-01")
+            + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+        }
+    )
+
+
+def main(rows: int):
+    df = syntheticSheet(rows)
+    print(f"{rows} rows x {len(df.columns)} columns")
+    print(f"{'format':<32}{'seconds':>10}{'bytes':>14}")
+
+    for encoder, download_name in encoders.values():
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in encoder(df))
+        elapsed = time.perf_counter() - start
+        print(f"{download_name:<32}{elapsed:>10.3f}{size:>14}")
+
+    # Reference: the pandas / openpyxl path sendDF used before negotiation
+    start = time.perf_counter()
+    from io import BytesIO
+
+    output = BytesIO()
+    df.to_excel(output, engine="openpyxl", index=False)
+    elapsed = time.perf_counter() - start
+    print(f"{'xlsx (to_excel)':<32}{elapsed:>10.3f}{len(output.getvalue()):>14}")
+
+    start = time.perf_counter()
+    data = toColumnar(df)
+    elapsed = time.perf_counter() - start
+    print(f"{'parquet (columnar copy)':<32}{elapsed:>10.3f}{len(data or b''):>14}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,372 @@
+# Micro-benchmarks of the data path: parsing, filtering, encoding, storage and export.
+# Workbooks are generated from a fixed seed, so runs on the same machine are comparable.
+# Usage:
+#   python benchmarks/suite.py [--profile quick|default|full] [--output results.json]
+#   python benchmarks/suite.py --baseline results.json [--threshold 0.2]
+# With --baseline the exit status is 1 if any benchmark got slower than the threshold.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+from cacheHelper import FilterCache  # noqa: E402
+from helperMethods import readFile, applyFilters, sendDF, encoders  # noqa: E402
+from serializers import syntheticSheet  # noqa: E402
+from sqlHelper import DB  # noqa: E402
+
+# (extension, rows per sheet, sheets) of the generated workbooks per profile.
+# odfpy writes and reads slowly, so ods stays small.
+PROFILES: dict = {
+    "quick": [
+        (".csv", 1_000, 1),
+        (".xlsx", 1_000, 1),
+        (".xlsx", 1_000, 5),
+        (".ods", 1_000, 1),
+    ],
+    "default": [
+        (".csv", 1_000, 1),
+        (".csv", 100_000, 1),
+        (".xlsx", 1_000, 1),
+        (".xlsx", 1_000, 50),
+        (".xlsx", 100_000, 1),
+        (".ods", 1_000, 1),
+        (".ods", 1_000, 10),
+    ],
+    "full": [
+        (".csv", 1_000, 1),
+        (".csv", 100_000, 1),
+        (".csv", 1_000_000, 1),
+        (".xlsx", 1_000, 1),
+        (".xlsx", 1_000, 50),
+        (".xlsx", 100_000, 1),
+        (".xlsx", 100_000, 10),
+        (".xlsx", 1_000_000, 1),
+        (".ods", 1_000, 1),
+        (".ods", 1_000, 50),
+        (".ods", 10_000, 1),
+    ],
+}
+
+# Rows of the sheet filtered and encoded, per profile
+FRAME_ROWS: dict = {"quick": 10_000, "default": 100_000, "full": 1_000_000}
+
+# One filter per method, on a dictionary encoded and a row-wise column, range
+# methods on a numeric and a date column
+FILTERS: dict = {
+    "exact": ("region", "region 7"),
+    "contains": ("region", "1"),
+    "not contains": ("region", "1"),
+    "regex": ("region", "region [1-3]$"),
+    "contains (rowwise)": ("amount", "12"),
+    ">": ("amount", "900"),
+    "between": ("date", "2024-03-01, 2024-03-31"),
+}
+
+
+# Server-side sorts, by a numeric column and by a str then a date column
+SORTS: dict = {
+    "amount": [("amount", False)],
+    "region, date desc": [("region", False), ("date", True)],
+}
+
+
+def makeWorkbook(ext: str, rows: int, sheets: int) -> bytes:
+    # Encode sheets of mixed dtypes (int, str, float, datetime) as a csv / xlsx / ods file
+    output = BytesIO()
+    if ext == ".csv":
+        syntheticSheet(rows).to_csv(output, index=False)
+        return output.getvalue()
+
+    engine: str = {".xlsx": "openpyxl", ".ods": "odf"}[ext]
+    with pd.ExcelWriter(output, engine=engine) as writer:
+        for sheet in range(sheets):
+            syntheticSheet(rows).to_excel(
+                writer, sheet_name=f"sheet {sheet}", index=False
+            )
+    return output.getvalue()
+
+
+def measure(fn: Callable[[], object], repeat: int) -> dict:
+    # Run fn repeat times, return timings in seconds
+    times: list = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+class Suite:
+    def __init__(self, profile: str, repeat: int):
+        self.profile: str = profile
+        self.repeat: int = repeat
+        self.results: dict = dict()
+        self.workbooks: dict = dict()  # (ext, rows, sheets) -> bytes
+        self.tmp_dir: str = tempfile.mkdtemp(prefix="bench-")
+
+    def run(self, name: str, fn: Callable[[], object], repeat: Optional[int] = None):
+        try:
+            result: dict = measure(fn, repeat or self.repeat)
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+
+        self.results[name] = result
+        timing: str = (
+            f"{result['median'] * 1000:>12.2f} ms"
+            if "median" in result
+            else f"  {result['error']}"
+        )
+        print(f"{name:<56}{timing}", flush=True)
+
+    def workbook(self, ext: str, rows: int, sheets: int) -> bytes:
+        key = (ext, rows, sheets)
+        if key not in self.workbooks:
+            self.workbooks[key] = makeWorkbook(ext, rows, sheets)
+        return self.workbooks[key]
+
+    def bench_readFile(self):
+        for ext, rows, sheets in PROFILES[self.profile]:
+            data: bytes = self.workbook(ext, rows, sheets)
+
+            def parse():
+                file = FileStorage(data, filename="bench" + ext)
+                if readFile(file) is None:
+                    raise ValueError("readFile returned None")
+
+            repeat: int = 1 if rows * sheets >= 1_000_000 else self.repeat
+            self.run(f"readFile{ext} rows={rows} sheets={sheets}", parse, repeat)
+
+    def bench_applyFilters(self):
+        df: pd.DataFrame = syntheticSheet(FRAME_ROWS[self.profile])
+        rows: int = len(df)
+        for label, (column, inp) in FILTERS.items():
+            method: str = label.split(" (")[0]
+            filters: list = [
+                {
+                    "id": 1,
+                    "version": 0,
+                    "column": df.columns.get_loc(column),
+                    "method": method,
+                    "input": inp,
+                    "enabled": True,
+                }
+            ]
+            self.run(
+                f"applyFilters {label} rows={rows}",
+                lambda: applyFilters(df, filters),
+            )
+
+            cache = FilterCache(256 * 1024 * 1024, 256 * 1024 * 1024, 256 * 1024 * 1024)
+            applyFilters(df, filters, cache, (1, 0, 0))  # Warm the caches
+            self.run(
+                f"applyFilters {label} cached rows={rows}",
+                lambda: applyFilters(df, filters, cache, (1, 0, 0)),
+            )
+
+    def bench_sort(self):
+        df: pd.DataFrame = syntheticSheet(FRAME_ROWS[self.profile])
+        rows: int = len(df)
+        for label, sort in SORTS.items():
+            keys: list = [
+                (df.columns.get_loc(column), descending) for column, descending in sort
+            ]
+            self.run(
+                f"sort {label} rows={rows}", lambda: applyFilters(df, [], sort=keys)
+            )
+
+            cache = FilterCache(256 * 1024 * 1024, 256 * 1024 * 1024, 256 * 1024 * 1024)
+            applyFilters(df, [], cache, (1, 0, 0), sort=keys)  # Warm the caches
+            self.run(
+                f"sort {label} cached rows={rows}",
+                lambda: applyFilters(df, [], cache, (1, 0, 0), sort=keys),
+            )
+
+    def bench_sendDF(self):
+        df: pd.DataFrame = syntheticSheet(FRAME_ROWS[self.profile])
+        for mimetype, (_, download_name) in encoders.items():
+            self.run(
+                f"sendDF {download_name} rows={len(df)}",
+                lambda: b"".join(sendDF(df, mimetype).iter_encoded()),
+            )
+
+    def bench_db(self):
+        db = DB(os.path.join(self.tmp_dir, "bench.db"))
+        for ext, rows, sheets in PROFILES[self.profile][:3]:
+            data: bytes = self.workbook(ext, rows, sheets)
+            ids: list = list()
+
+            def add():
+                ok, msg, file_id = db.add_file(
+                    "bench" + ext, FileStorage(BytesIO(data), filename="bench" + ext)
+                )
+                if not ok:
+                    raise RuntimeError(msg)
+                ids.append(file_id)
+
+            # Named by shape, the xlsx sizes vary slightly between runs
+            self.run(f"DB.add_file{ext} rows={rows} sheets={sheets}", add)
+            self.run(
+                f"DB.get_file{ext} rows={rows} sheets={sheets}",
+                lambda: db.get_file(ids[-1]),
+            )
+        db.close()
+
+    def bench_zip_export(self):
+        # Through the Flask test client, with a database of its own
+        os.chdir(tempfile.mkdtemp(dir=self.tmp_dir))  # app.py creates files.db here
+        import app
+
+        client = app.create_app().test_client()
+        try:
+            for ext, rows, sheets in PROFILES[self.profile][:3]:
+                data: bytes = self.workbook(ext, rows, sheets)
+                client.post(
+                    "/files/upload",
+                    data={"file": (BytesIO(data), f"bench {rows}x{sheets}{ext}")},
+                )
+
+            files: int = len(app.db.get_all_file_ids())
+
+            def export():
+                # Closing the response releases its render slot
+                with client.get("/files/get/all/compressed") as response:
+                    if response.status_code != 200:
+                        raise RuntimeError(f"HTTP {response.status_code}")
+                    response.get_data()  # Produce the whole streamed archive
+
+            self.run(f"ZIP export files={files}", export)
+        finally:
+            app.ingest_queue.stop()
+            app.offload.shutdown()
+
+    def all(self):
+        self.bench_readFile()
+        self.bench_applyFilters()
+        self.bench_sort()
+        self.bench_sendDF()
+        self.bench_db()
+        self.bench_zip_export()
+
+
+def environment() -> dict:
+    from importlib.metadata import version
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "openpyxl": version("openpyxl"),
+        "flask": version("flask"),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> Tuple[list, list]:
+    # Print the change of every benchmark in both runs, return the regressed ones and
+    # the failed ones: measured in the baseline, but errored or missing now
+    regressions: list = list()
+    failures: list = list()
+    print(f"\n{'benchmark':<56}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name in [*baseline, *(name for name in results if name not in baseline)]:
+        before: Optional[dict] = baseline.get(name)
+        current: Optional[dict] = results.get(name)
+        if not before or "median" not in before:
+            continue  # New, or failing already
+
+        if current is None or "median" not in current:
+            failures.append(name)
+            reason: str = "missing" if current is None else current["error"]
+            print(f"{name:<56}{before['median'] * 1000:>14.2f}  FAILED {reason}")
+            continue
+
+        ratio: float = current["median"] / before["median"]
+        flag: str = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<56}{before['median'] * 1000:>14.2f}{current['median'] * 1000:>14.2f}"
+            f"{(ratio - 1) * 100:>+9.1f}%{flag}"
+        )
+
+    return regressions, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data path micro-benchmarks")
+    parser.add_argument("--profile", choices=PROFILES, default="default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slow down counted as a regression (default 0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    output: Optional[str] = os.path.abspath(args.output) if args.output else None
+    baseline: Optional[str] = os.path.abspath(args.baseline) if args.baseline else None
+
+    suite = Suite(args.profile, args.repeat)
+    suite.all()
+
+    report: dict = {
+        "profile": args.profile,
+        "environment": environment(),
+        "results": suite.results,
+    }
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"\nWrote {output}")
+
+    failed: bool = False
+    errors: list = [name for name, result in suite.results.items() if "error" in result]
+    if errors:
+        print(f"\n{len(errors)} benchmarks failed")
+        failed = True
+
+    if baseline:
+        with open(baseline) as file:
+            before: dict = json.load(file)
+        if before.get("profile") != args.profile:
+            print(f"Warning: baseline was run with profile {before.get('profile')}")
+
+        regressions, failures = compare(
+            suite.results, before["results"], args.threshold
+        )
+        if regressions:
+            print(f"\n{len(regressions)} regressions above {args.threshold:.0%}")
+            failed = True
+        if failures:
+            print(f"{len(failures)} benchmarks of the baseline failed or didn't run")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Content-addressed blob store
+
+import os
+import hashlib
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Generator, Iterator, Tuple
+
+BLOB_CHUNK_SIZE: int = 1024 * 1024  # Bytes copied per read / write
+
+
+class BlobStore:
+    # Stores file contents on disk under their SHA-256 hash, so identical
+    # uploads share a single copy. Reference counting lives in the DB.
+    def __init__(self, root: os.PathLike):
+        self.root = root
+        self.tmp_dir: str = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, hash: str) -> str:
+        # Fan out into sub directories by the first two hex digits
+        return os.path.join(self.root, hash[:2], hash)
+
+    def stage(self, stream: BinaryIO) -> Tuple[str, int, str]:
+        # Copy a stream in chunks into a temporary file, return its hash, size and
+        # temporary path. Call commit (or discard) once the DB references the hash.
+        digest = hashlib.sha256()
+        size: int = 0
+        with NamedTemporaryFile(dir=self.tmp_dir, delete=False) as tmp:
+            while chunk := stream.read(BLOB_CHUNK_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        return digest.hexdigest(), size, tmp.name
+
+    def commit(self, hash: str, tmp_path: str):
+        # Move a staged file into place, unless identical content is already stored
+        path: str = self.path(hash)
+        if os.path.exists(path):
+            self.discard(tmp_path)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def discard(self, tmp_path: str):
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def exists(self, hash: str) -> bool:
+        return os.path.exists(self.path(hash))
+
+    def read(self, hash: str) -> bytes:
+        with open(self.path(hash), "rb") as file:
+            return file.read()
+
+    def iter(self, hash: str) -> Generator[bytes, None, None]:
+        with open(self.path(hash), "rb") as file:
+            while chunk := file.read(BLOB_CHUNK_SIZE):
+                yield chunk
+
+    def delete(self, hash: str):
+        path: str = self.path(hash)
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))  # Only succeeds once the directory is empty
+        except OSError:
+            pass
+
+    def hashes(self) -> Iterator[str]:
+        # Iterate over the hash of every stored blob
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and len(entry.name) == 2:
+                for blob in os.scandir(entry.path):
+                    yield blob.name
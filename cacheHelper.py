@@ -0,0 +1,117 @@
+# Caching helpers
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+
+def sizeOfFrames(value) -> int:
+    # Approximate memory footprint in bytes of a DataFrame or a dict of them
+    if isinstance(value, dict):
+        return sum(sizeOfFrames(df) for df in value.values())
+    return int(value.memory_usage(index=True, deep=True).sum())
+
+
+class LRUCache:
+    # Thread-safe LRU cache bounded by an approximate memory budget in bytes.
+    # Keys are tuples whose first item is the file id they belong to, so every
+    # entry of a file can be dropped at once through invalidate.
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int]):
+        self.max_bytes: int = max_bytes
+        self.sizeof: Callable[[Any], int] = sizeof
+        self.entries: OrderedDict = OrderedDict()  # key -> (value, size)
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock: Lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            return entry[0]
+
+    def contains(self, key: Hashable) -> bool:
+        # Whether key is cached, without counting a hit or marking it as used
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key: Hashable, value: Any) -> bool:
+        # Store value, evicting least recently used entries to fit the budget
+        size: int = self.sizeof(value)
+        if size > self.max_bytes:
+            return False  # Would evict everything and still not fit
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+        return True
+
+    def invalidate(self, file_id: Optional[int] = None) -> int:
+        # Drop every entry of the given file, or everything if file_id is None
+        with self.lock:
+            if file_id is None:
+                dropped = len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                return dropped
+
+            keys = [key for key in self.entries if key[0] == int(file_id)]
+            for key in keys:
+                self.size -= self.entries.pop(key)[1]
+
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class FilterCache:
+    # Caches backing incremental filter evaluation: packed row masks of single
+    # filters, encoded str values of filtered columns and sort orders of range
+    # filtered or sorted columns
+    def __init__(
+        self, masks_max_bytes: int, encodings_max_bytes: int, orders_max_bytes: int
+    ):
+        self.masks: LRUCache = LRUCache(masks_max_bytes, lambda packed: packed.nbytes)
+        self.encodings: LRUCache = LRUCache(
+            encodings_max_bytes, lambda encoded: encoded.nbytes
+        )
+        self.orders: LRUCache = LRUCache(orders_max_bytes, lambda sort: sort.nbytes)
+
+    def invalidate(self, file_id: Optional[int] = None) -> int:
+        return (
+            self.masks.invalidate(file_id)
+            + self.encodings.invalidate(file_id)
+            + self.orders.invalidate(file_id)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "masks": self.masks.stats(),
+            "encodings": self.encodings.stats(),
+            "orders": self.orders.stats(),
+        }
@@ -0,0 +1,165 @@
+# CSV engine: sniffs encoding and delimiter, parses in chunks with dtypes
+# inferred from a sample, returns a single-sheet workbook like the Excel readers
+
+from __future__ import annotations
+
+import csv
+import os
+from typing import TYPE_CHECKING, BinaryIO, Optional, Tuple
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CSV_SNIFF_BYTES: int = 64 * 1024  # Bytes inspected for the encoding and delimiter
+CSV_SAMPLE_ROWS: int = 10_000  # Rows the column dtypes are inferred from
+CSV_CHUNK_ROWS: int = 100_000  # Rows parsed at once, bounds the parser's memory
+CSV_DELIMITERS: str = ",;\t|"
+
+# "c" parses in chunks; "pyarrow" parses the whole file at once, multi-threaded.
+# Read from the environment so the ingest worker processes see it too.
+CSV_ENGINE: str = os.environ.get("CSV_ENGINE", "c")
+
+# UTF-32 first, its little-endian BOM starts with the UTF-16 one
+BOMS: Tuple[Tuple[bytes, str], ...] = (
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe\x00\x00", "utf-32"),
+    (b"\x00\x00\xfe\xff", "utf-32"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+)
+
+# Encodings of BOM-less wide text by code unit width and the offsets within a
+# unit that hold zero bytes for ASCII characters
+WIDE_ENCODINGS: Tuple[Tuple[str, int, Tuple[int, ...]], ...] = (
+    ("utf-32-le", 4, (1, 2, 3)),
+    ("utf-32-be", 4, (0, 1, 2)),
+    ("utf-16-le", 2, (1,)),
+    ("utf-16-be", 2, (0,)),
+)
+
+
+def detectWideEncoding(head: bytes) -> Optional[str]:
+    # UTF-16/32 without a BOM: mostly ASCII text has its zero bytes at fixed
+    # offsets of each code unit, and decodes without NUL characters
+    for encoding, width, offsets in WIDE_ENCODINGS:
+        units: int = len(head) // width
+        zeros: int = sum(
+            head[offset : units * width : width].count(0) for offset in offsets
+        )
+        if not units or zeros < units * len(offsets) / 2:
+            continue
+        try:
+            if "\x00" not in head[: units * width].decode(encoding):
+                return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def detectEncoding(head: bytes) -> str:
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    if b"\x00" in head:
+        wide: Optional[str] = detectWideEncoding(head)
+        if wide is not None:
+            return wide
+
+    try:
+        head.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(head) - 3:
+            return "utf-8"  # Only the last character was cut off by the sniff size
+
+    try:
+        from charset_normalizer import from_bytes
+
+        match = from_bytes(head).best()
+        if match is not None:
+            return match.encoding
+    except ImportError:
+        pass
+
+    return "latin-1"  # Decodes any byte sequence
+
+
+def detectDelimiter(head: bytes, encoding: str) -> str:
+    text: str = head.decode(encoding, errors="ignore")
+    if len(head) >= CSV_SNIFF_BYTES and "\n" in text:
+        text = text[: text.rindex("\n")]  # Drop the partial last line
+
+    try:
+        return csv.Sniffer().sniff(text, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        return ","  # Single column or too irregular to tell
+
+
+def inferDtypes(sample: pd.DataFrame) -> dict:
+    # Numeric and boolean dtypes of the sample are enforced on every chunk, so
+    # chunks agree and the parser skips inference. Other columns are inferred.
+    return {
+        column: dtype for column, dtype in sample.dtypes.items() if dtype.kind in "biuf"
+    }
+
+
+def readCSV(stream: BinaryIO, name: str = "Sheet1") -> dict[str, pd.DataFrame]:
+    # Parse a csv file as a workbook with a single sheet called name
+    import pandas as pd
+    from pandas.errors import EmptyDataError
+
+    head: bytes = stream.read(CSV_SNIFF_BYTES)
+    stream.seek(0)
+    encoding: str = detectEncoding(head)
+    options: dict = {"sep": detectDelimiter(head, encoding), "encoding": encoding}
+
+    try:
+        if CSV_ENGINE == "pyarrow":
+            try:
+                import pyarrow  # noqa: F401
+
+                return {name: pd.read_csv(stream, engine="pyarrow", **options)}
+            except ImportError:
+                pass  # Fall back to the chunked parser
+
+        sample: pd.DataFrame = pd.read_csv(stream, nrows=CSV_SAMPLE_ROWS, **options)
+        if len(sample) < CSV_SAMPLE_ROWS:
+            return {name: sample}  # Already the whole file
+
+        stream.seek(0)
+        dtype: Optional[dict] = inferDtypes(sample)
+        try:
+            df: pd.DataFrame = readChunks(stream, dtype, options)
+        except (ValueError, TypeError):
+            # A later row doesn't fit the sample's dtypes, e.g. text in a numeric column
+            stream.seek(0)
+            df = readChunks(stream, None, options)
+
+        return {name: df}
+    except EmptyDataError:
+        return {name: pd.DataFrame()}
+
+
+def readChunks(stream: BinaryIO, dtype: Optional[dict], options: dict) -> pd.DataFrame:
+    import pandas as pd
+
+    chunks = pd.read_csv(stream, chunksize=CSV_CHUNK_ROWS, dtype=dtype, **options)
+    with chunks:
+        return pd.concat(list(chunks), ignore_index=True)
+
+
+def readCSVHead(stream: BinaryIO, rows: int) -> pd.DataFrame:
+    # The first rows of a csv file, sniffed like readCSV, for previews
+    import pandas as pd
+    from pandas.errors import EmptyDataError
+
+    head: bytes = stream.read(CSV_SNIFF_BYTES)
+    stream.seek(0)
+    encoding: str = detectEncoding(head)
+    try:
+        return pd.read_csv(
+            stream, nrows=rows, sep=detectDelimiter(head, encoding), encoding=encoding
+        )
+    except EmptyDataError:
+        return pd.DataFrame()
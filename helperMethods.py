@@ -1,22 +1,87 @@
 # Helper methods
+# numpy / pandas are imported where first used, so importing this module (and
+# serving static files) doesn't pay for them. Annotations aren't evaluated.
 
+from __future__ import annotations
+
+import codecs
 import os
-import pandas as pd
 import re
+import hashlib
+import json
+from collections import Counter
 from werkzeug.datastructures import FileStorage
 
-from flask import jsonify, Response, send_file
-from typing import Optional
+from flask import jsonify, Response
+from werkzeug.datastructures import MIMEAccept
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+from io import BytesIO, RawIOBase
+from tempfile import TemporaryFile
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from cacheHelper import FilterCache
+from csvHelper import detectEncoding, readCSV
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
 
-from io import BytesIO
+def readExcel(stream, name: str) -> dict[str, pd.DataFrame]:
+    # Every sheet, by sheet name. pandas loads the engine (openpyxl / odfpy) on
+    # first use of each format.
+    import pandas as pd
 
+    return pd.read_excel(stream, sheet_name=None)
+
+
+# Parse a file stream into {sheet name: data-frame}, name is the file's name
 readers = {
-    ".csv": pd.read_csv,
-    ".xlsx": pd.read_excel,
-    ".ods": pd.read_excel,
+    ".csv": readCSV,
+    ".xlsx": readExcel,
+    ".ods": readExcel,
 }
 ALLOWED_EXTENSIONS: set = set(readers.keys())
 
+SNIFF_BYTES: int = 64 * 1024  # Bytes of a text file inspected when sniffing
+
+
+def sniffText(stream) -> bool:
+    # Text (csv) files decode in the encoding the csv reader detects (by BOM,
+    # UTF-16/32 layout, UTF-8, ...) to text without NUL characters
+    head: bytes = stream.read(SNIFF_BYTES)
+    decoder = codecs.getincrementaldecoder(detectEncoding(head))()
+    try:
+        text: str = decoder.decode(head)  # The sniff size may cut the last character
+    except UnicodeDecodeError:
+        return False
+    return "\x00" not in text
+
+
+def sniffXlsx(stream) -> bool:
+    # xlsx is a zip archive (OOXML package) holding a workbook part
+    with ZipFile(stream) as archive:
+        return "xl/workbook.xml" in archive.namelist()
+
+
+def sniffOds(stream) -> bool:
+    # ods is a zip archive whose mimetype member names the spreadsheet type
+    with ZipFile(stream) as archive:
+        if "mimetype" not in archive.namelist():
+            return False
+        return archive.read("mimetype").startswith(
+            b"application/vnd.oasis.opendocument.spreadsheet"
+        )
+
+
+# Content checks for every extension in readers
+sniffers = {
+    ".csv": sniffText,
+    ".xlsx": sniffXlsx,
+    ".ods": sniffOds,
+}
+
 
 def isAValidExt(filename: str) -> bool:
     global ALLOWED_EXTENSIONS
@@ -31,42 +96,232 @@ def isAValidFileName(filename: str) -> bool:
     return bool(filename)  # If not null or empty
 
 
+def validateFile(file: FileStorage) -> tuple[bool, str]:
+    # Check a file's extension is readable and that its contents match it
+    ext: str = os.path.splitext(os.path.basename(file.filename or ""))[1]
+    if ext not in readers:
+        return False, f"Unsupported extension {ext or '(none)'}"
+
+    stream = file.stream
+    position: int = stream.tell()
+    try:
+        if not sniffers[ext](stream):
+            return False, f"Contents don't match the {ext} extension"
+    except Exception as e:
+        return False, f"Unreadable {ext} file: {e}"
+    finally:
+        stream.seek(position)  # Leave the stream as found for storing
+
+    return True, "Valid"
+
+
 def verifyKeys(json, key_set: set) -> bool:
     # Verifies if json contains every key from the given set
     return json and key_set.issubset(json.keys())
 
 
+def verifyColumns(columns: Iterable[int], width: int) -> bool:
+    # Verifies if every 0-based column position exists in a sheet width columns wide
+    return all(0 <= column < width for column in columns)
+
+
+def makeETag(*parts) -> str:
+    # Strong entity tag of a response, derived from everything that determines its body
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[
+        :32
+    ]
+
+
 def readFile(file: FileStorage, ext: str = None) -> Optional[dict[str, pd.DataFrame]]:
     try:
         if not ext:
             ext = os.path.splitext(file.filename)[1]  # Try to find ext
 
         file_content = BytesIO(file.stream)
+        name: str = os.path.splitext(os.path.basename(file.filename or ""))[0]
 
-        df: dict[str, pd.DataFrame] = readers[ext](file_content, sheet_name=None)
+        df: dict[str, pd.DataFrame] = readers[ext](file_content, name or "Sheet1")
         return df
     except Exception as e:
         print(e)
         return None
 
 
-def sendDF(df: pd.DataFrame) -> Response:
+def toColumnar(df: pd.DataFrame) -> Optional[bytes]:
+    # Encode a sheet as Parquet, None if it can't be represented (e.g. mixed-type columns)
     try:
-        # Save the DataFrame to BytesIO using openpyxl as the engine
+        df = df.copy(deep=False)
+        df.columns = [str(column) for column in df.columns]  # Parquet needs str names
+
         output = BytesIO()
-        df.to_excel(output, engine="openpyxl", index=False)
-        output.seek(0)  # Move to beginning of file
-
-        response = send_file(
-            output,
-            as_attachment=False,
-            download_name="sheet.xlsx",
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        df.to_parquet(output, index=False)
+        return output.getvalue()
+    except Exception as e:
+        print(e)
+        return None
+
+
+def describeSheets(sheets: dict[str, pd.DataFrame]) -> list[dict]:
+    # Columnar copy and catalog metadata of each sheet, in the format DB.set_sheets stores
+    return [
+        {
+            "name": name,
+            "data": toColumnar(df),
+            "rows": len(df),
+            "column_names": [str(column) for column in df.columns],
+            "dtypes": [str(dtype) for dtype in df.dtypes],
+        }
+        for name, df in sheets.items()
+    ]
+
 
-        return response
+def readColumnar(data: bytes, columns: Optional[list] = None) -> pd.DataFrame:
+    # Decode a Parquet sheet, reading only the given column names if specified
+    import pandas as pd
+
+    return pd.read_parquet(BytesIO(data), columns=columns)
+
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIMETYPE = "text/csv"
+JSON_MIMETYPE = "application/json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+CHUNK_ROWS: int = 10_000  # Rows encoded per streamed chunk
+CHUNK_BYTES: int = 1024 * 1024  # Bytes of an encoded file sent per streamed chunk
+
+
+def encodeXlsx(df: pd.DataFrame) -> Iterator[bytes]:
+    # openpyxl's write-only worksheet spools appended rows to a temporary file, so
+    # only a chunk of rows is converted to cells at a time. The archive is saved
+    # to disk as well and streamed from there.
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    worksheet.append([str(column) for column in df.columns])
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk: pd.DataFrame = df.iloc[start : start + CHUNK_ROWS]
+        cells: pd.DataFrame = chunk.astype(object).where(chunk.notna(), None)
+        for row in cells.itertuples(index=False, name=None):  # NaN as empty
+            worksheet.append(row)
+
+    with TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while data := output.read(CHUNK_BYTES):
+            yield data
+
+
+def encodeCSV(df: pd.DataFrame) -> Iterator[bytes]:
+    for start in range(0, max(len(df), 1), CHUNK_ROWS):
+        chunk: pd.DataFrame = df.iloc[start : start + CHUNK_ROWS]
+        yield chunk.to_csv(header=start == 0, index=False).encode("utf-8")
+
+
+def encodeJSON(df: pd.DataFrame) -> Iterator[bytes]:
+    # Columnar JSON: {"columns": [names], "data": [[column values], ...]}
+    yield b'{"columns": '
+    yield json.dumps([str(column) for column in df.columns]).encode("utf-8")
+    yield b', "data": ['
+    for index in range(len(df.columns)):
+        if index:
+            yield b", "
+        column: pd.Series = df.iloc[:, index]
+        yield column.to_json(orient="values", date_format="iso").encode("utf-8")
+    yield b"]}"
+
+
+def encodeArrow(df: pd.DataFrame) -> Iterator[bytes]:
+    # Arrow IPC stream, one message per record batch
+    import pyarrow as pa
+
+    df = df.copy(deep=False)
+    df.columns = [str(column) for column in df.columns]  # Arrow needs str names
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    sink = BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()  # End of stream marker
+
+
+encoders = {
+    XLSX_MIMETYPE: (encodeXlsx, "sheet.xlsx"),
+    CSV_MIMETYPE: (encodeCSV, "sheet.csv"),
+    JSON_MIMETYPE: (encodeJSON, "sheet.json"),
+    ARROW_MIMETYPE: (encodeArrow, "sheet.arrow"),
+}
+
+
+def negotiateMimetype(accept: MIMEAccept) -> str:
+    # Pick the best supported sheet format for an Accept header, xlsx if none matches
+    return accept.best_match(list(encoders.keys()), default=XLSX_MIMETYPE)
+
+
+def sendDF(df: pd.DataFrame, mimetype: str = XLSX_MIMETYPE) -> Response:
+    try:
+        encoder, download_name = encoders[mimetype]
+        chunks: Iterator[bytes] = encoder(df)
+        first: bytes = next(chunks)  # Surface encoding errors before streaming starts
+
+        def stream() -> Iterator[bytes]:
+            yield first
+            yield from chunks
+
+        return Response(
+            stream(),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"inline; filename={download_name}"},
+        )
     except Exception as e:
-        return jsonify({"error": e}), 500
+        return jsonify({"error": str(e)}), 500
+
+
+def sendEncoded(data: bytes, mimetype: str = XLSX_MIMETYPE) -> Response:
+    # Send a sheet already encoded by the encoder of mimetype
+    _, download_name = encoders[mimetype]
+    return Response(
+        data,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"inline; filename={download_name}"},
+    )
+
+
+class StreamBuffer(RawIOBase):
+    # Unseekable sink collecting what ZipFile writes so it can be yielded as it goes
+    def __init__(self):
+        self.chunks: list[bytes] = list()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data: bytes = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zipStream(entries: Iterable[tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    # Build a ZIP64 archive of (name, chunks) entries, yielding it piece by piece.
+    # The sink is unseekable, so ZipFile writes sizes in data descriptors.
+    sink = StreamBuffer()
+    with ZipFile(sink, "w", ZIP_DEFLATED) as zip_file:
+        for name, chunks in entries:
+            with zip_file.open(name, "w", force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()  # Central directory
 
 
 def escapeRegEx(regEx: str) -> str:
@@ -74,41 +329,378 @@ def escapeRegEx(regEx: str) -> str:
     return re.sub(r"[.*+?^${}()|[\]\\]", r"\\\g<0>", regEx)
 
 
-def applyFilters(df: pd.DataFrame, filters: list) -> pd.DataFrame:
-    # Apply filters to data-frame, return new data-frame
-    # filters is a list of dicts with the following keys: input, method, column, enabled
+# Filter methods evaluated on a column's sort order instead of its str values
+RANGE_METHODS: tuple = (">", "<", "between")
+FILTER_METHODS: tuple = ("exact", "contains", "not contains", "regex", *RANGE_METHODS)
 
-    # TODO: Make sure regex method works
-    new_df: pd.DataFrame = df.copy()  # Dont destroy original
+
+def compileFilter(filter: dict) -> Callable:
+    # Compile a filter into a predicate from a column's str values to a row mask, or
+    # for range methods from the column's SortedColumn to a row mask
+    inp, method = filter["input"], filter["method"]
+
+    if method == ">":
+        # Rows where the column values are greater than the input
+        return lambda column: column.range(inp, None, inclusive=False)
+    elif method == "<":
+        # Rows where the column values are less than the input
+        return lambda column: column.range(None, inp, inclusive=False)
+    elif method == "between":
+        # Rows where the column values lie between the comma separated inputs, inclusive
+        low, comma, high = inp.partition(",")
+        if not comma:
+            raise ValueError("Between needs two values separated by a comma")
+        return lambda column: column.range(low, high, inclusive=True)
+
+    if method != "regex":
+        inp = escapeRegEx(inp)
+
+    if method == "exact":
+        # Rows where the column values exactly match the input string
+        return lambda strings: strings.eq(inp).to_numpy(dtype=bool)
+
+    pattern: re.Pattern = re.compile(inp)  # Compiled once per filter
+    if method == "contains":
+        # Rows where the column values contain the input string
+        return lambda strings: strings.str.contains(pattern).to_numpy(dtype=bool)
+    elif method == "not contains":
+        # Rows where the column values do not contain the input string
+        return lambda strings: ~strings.str.contains(pattern).to_numpy(dtype=bool)
+    elif method == "regex":
+        # Rows where the column values match the regex pattern
+        return lambda strings: strings.str.match(pattern).to_numpy(dtype=bool)
+
+    raise ValueError("Unsupported method")
+
+
+def parseSort(value) -> list[tuple[int, bool]]:
+    # Sort keys of a request as (column, descending) pairs, the first one primary.
+    # From JSON [{"column": 2, "descending": true}, ...] or a query string "2:desc,0".
+    if not value:
+        return list()
+
+    if isinstance(value, str):
+        keys: list = list()
+        for part in value.split(","):
+            column, _, direction = part.partition(":")
+            keys.append((int(column), direction.strip().lower() == "desc"))
+        return keys
+
+    return [(int(key["column"]), bool(key.get("descending", False))) for key in value]
+
+
+def compileFilters(filters: list) -> list[tuple[dict, Callable]]:
+    # Compile the enabled filters into a plan of (filter, predicate) pairs
+    # filters is a list of dicts with the following keys: input, method, column, enabled
+    # and optionally id and version, which identify a filter's cached mask.
+    # Filters stored before their input was validated are skipped if they don't compile.
+    plan: list = list()
     for filter in filters:
-        inp, method, column, enabled = (
-            filter["input"],
-            filter["method"],
-            filter["column"],
-            filter["enabled"],
+        if not filter["enabled"]:
+            continue
+        try:
+            plan.append((filter, compileFilter(filter)))
+        except (ValueError, re.error) as e:
+            print(f"Skipped filter {filter.get('id')}: {e}")
+    return plan
+
+
+def rangeKind(dtype) -> str:
+    # How range filters and sorts compare the values of a column of the given dtype
+    from pandas.api.types import (
+        is_datetime64_any_dtype,
+        is_numeric_dtype,
+        pandas_dtype,
+    )
+
+    try:
+        dtype = pandas_dtype(dtype)
+    except TypeError:
+        return "text"
+
+    if is_datetime64_any_dtype(dtype):
+        return "date"
+    if is_numeric_dtype(dtype):
+        return "number"
+    return "text"
+
+
+def parseRangeValue(text: str, kind: str):
+    # A range filter input as a value of the given kind
+    import numpy as np
+    import pandas as pd
+
+    text = text.strip()
+    try:
+        if kind == "number":
+            value: float = float(text)
+            if np.isnan(value):
+                raise ValueError  # Compares false with everything, not a bound
+            return value
+        if kind == "date":
+            timestamp = pd.Timestamp(text)
+            if timestamp is pd.NaT:
+                raise ValueError  # From "", "nan" or "NaT"
+            return np.datetime64(timestamp.tz_localize(None))
+    except ValueError:
+        raise ValueError(f"{text!r} is not a {kind}") from None
+    return text
+
+
+def validateFilter(method: str, inp: str, dtype: Optional[str]) -> Optional[str]:
+    # Error message if a filter can't be applied, None if it can. dtype is the
+    # cataloged dtype of the filtered column, None if it isn't known yet.
+    if method not in FILTER_METHODS:
+        return f"Unsupported method {method!r}"
+
+    if method == "regex":
+        try:
+            re.compile(inp)
+        except re.error as e:
+            return f"Invalid regex: {e}"
+
+    if method not in RANGE_METHODS:
+        return None
+
+    bounds: list = [inp]
+    if method == "between":
+        low, comma, high = inp.partition(",")
+        if not comma:
+            return "Between needs two values separated by a comma"
+        bounds = [low, high]
+
+    if dtype is None:
+        return None
+    try:
+        for bound in bounds:
+            parseRangeValue(bound, rangeKind(dtype))
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+# Columns with at most this many distinct values per row are dictionary encoded
+DICTIONARY_MAX_RATIO: float = 0.5
+
+filter_paths: Counter = Counter()  # Predicate evaluations per encoding path
+
+
+class EncodedColumn:
+    # A column's values as str, dictionary encoded (codes into str uniques) when it
+    # has few distinct values so predicates run once per unique instead of per row
+    def __init__(self, series: pd.Series, max_ratio: float = DICTIONARY_MAX_RATIO):
+        import pandas as pd
+
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        if len(uniques) <= max_ratio * len(series):
+            self.path: str = "dictionary"
+            self.codes: Optional[np.ndarray] = codes
+            self.values: pd.Series = pd.Series(uniques).astype(str)
+        else:
+            self.path = "rowwise"
+            self.codes = None
+            self.values = series.astype(str)
+
+        self.nbytes: int = int(self.values.memory_usage(deep=True))
+        if self.codes is not None:
+            self.nbytes += self.codes.nbytes
+
+    def evaluate(self, predicate: Callable[[pd.Series], np.ndarray]) -> np.ndarray:
+        filter_paths[self.path] += 1
+        mask: np.ndarray = predicate(self.values)
+        return mask if self.codes is None else mask[self.codes]
+
+
+class SortedColumn:
+    # A column's rows in ascending value order, nulls last: order is the stable argsort
+    # permutation and values the non-null values in that order, so range filters are
+    # two binary searches. Numeric and date columns compare by value, others as str.
+    def __init__(self, series: pd.Series):
+        import numpy as np
+        import pandas as pd
+
+        self.kind: str = rangeKind(series.dtype)
+        if self.kind == "date":
+            if getattr(series.dtype, "tz", None) is not None:
+                series = series.dt.tz_convert(None)
+            keys: np.ndarray = series.to_numpy()
+        elif self.kind == "number":
+            keys = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            keys = series.astype(str).to_numpy(dtype=object)
+
+        nulls: np.ndarray = series.isna().to_numpy()
+        valid: np.ndarray = np.flatnonzero(~nulls)
+        ascending: np.ndarray = np.argsort(keys[valid], kind="stable")
+        self.values: np.ndarray = keys[valid][ascending]
+        self.order: np.ndarray = np.concatenate(
+            [valid[ascending], np.flatnonzero(nulls)]
+        )
+
+        # Dense rank of each row's value for multi-column sorts: ties share a rank
+        dense: np.ndarray = np.zeros(len(self.values), dtype=np.int64)
+        if len(self.values) > 1:
+            np.cumsum(self.values[1:] != self.values[:-1], out=dense[1:])
+        self.null_rank: int = int(dense[-1]) + 1 if len(dense) else 0
+        self.ranks: np.ndarray = np.full(
+            len(self.order), self.null_rank, dtype=np.int64
         )
+        self.ranks[self.order[: len(self.values)]] = dense
+
+        self.nbytes: int = self.order.nbytes + self.values.nbytes + self.ranks.nbytes
+        if self.kind == "text":
+            self.nbytes += int(pd.Series(self.values).memory_usage(deep=True))
+
+    def parse(self, text: str):
+        # A filter input as a value comparable with the column's values
+        value = parseRangeValue(text, self.kind)
+        if self.kind == "date":
+            return value.astype(self.values.dtype)
+        return value
+
+    def range(self, low: Optional[str], high: Optional[str], inclusive: bool):
+        # Row mask of the values between low and high, either may be None (unbounded)
+        import numpy as np
+
+        start: int = 0
+        end: int = len(self.values)
+        if low is not None:
+            side: str = "left" if inclusive else "right"
+            start = int(np.searchsorted(self.values, self.parse(low), side=side))
+        if high is not None:
+            side = "right" if inclusive else "left"
+            end = int(np.searchsorted(self.values, self.parse(high), side=side))
+
+        mask: np.ndarray = np.zeros(len(self.order), dtype=bool)
+        mask[self.order[start : max(start, end)]] = True
+        return mask
+
+    def sortKey(self, descending: bool) -> np.ndarray:
+        # Ranks ordering the rows by this column, nulls last either way
+        import numpy as np
+
+        if not descending:
+            return self.ranks
+        return np.where(
+            self.ranks == self.null_rank,
+            self.null_rank,
+            self.null_rank - 1 - self.ranks,
+        )
+
 
-        if not enabled:
-            continue  # Skip
-
-        column_name = new_df.columns[column]  # Get column name
-
-        if method != "regex":
-            inp = escapeRegEx(inp)
-
-        if method == "exact":
-            # Filter rows where the column values exactly match the input string
-            new_df = new_df[new_df[column_name].astype(str).eq(inp)]
-        elif method == "contains":
-            # Filter rows where the column values contain the input string
-            new_df = new_df[new_df[column_name].astype(str).str.contains(inp)]
-        elif method == "not contains":
-            # Filter rows where the column values do not contain the input string
-            new_df = new_df[~new_df[column_name].astype(str).str.contains(inp)]
-        elif method == "regex":
-            # Filter rows where the column values match the regex pattern
-            new_df = new_df[new_df[column_name].astype(str).str.match(inp)]
+def sortRows(keys: list[tuple[SortedColumn, bool]]) -> np.ndarray:
+    # Row permutation sorting by the given (column, descending) keys, the first primary
+    import numpy as np
+
+    column, descending = keys[0]
+    if len(keys) == 1 and not descending:
+        return column.order  # Computed once and cached with the column
+
+    # lexsort's last key is the primary one
+    return np.lexsort([column.sortKey(descending) for column, descending in keys[::-1]])
+
+
+def applyFilters(
+    df: pd.DataFrame,
+    filters: list,
+    cache: Optional[FilterCache] = None,
+    key: tuple = (),
+    columns: Optional[list] = None,
+    sort: Optional[list] = None,
+) -> pd.DataFrame:
+    # Apply filters to data-frame in a single pass, return new data-frame.
+    # If cache is given, each filter's packed row mask is kept under
+    # key + (filter id, filter version) and each filtered column's encoding and sort
+    # order under key + (column,), so only new or edited filters are evaluated.
+    # columns lists the sheet column of each df column when df is a projection.
+    # sort lists (column, descending) pairs the remaining rows are ordered by.
+    import numpy as np
+
+    plan: list = compileFilters(filters)
+    positions: Optional[dict] = None
+    if columns is not None:
+        positions = {column: index for index, column in enumerate(columns)}
+
+    mask: np.ndarray = np.ones(len(df), dtype=bool)
+    encoded: dict = dict()  # Encoded columns, built once per column
+    ordered: dict = dict()  # Sorted columns, built once per column
+    for filter, predicate in plan:
+        mask_key: Optional[tuple] = None
+        if cache is not None and "id" in filter:
+            mask_key = (*key, filter["id"], filter.get("version", 0))
+            packed: np.ndarray = cache.masks.get(mask_key)
+            if packed is not None:
+                mask &= np.unpackbits(packed, count=len(df)).astype(bool)
+                continue
+
+        column: int = filter["column"]
+        if filter["method"] in RANGE_METHODS:
+            if column not in ordered:
+                ordered[column] = sortColumn(df, column, positions, cache, key)
+            filter_paths["sorted"] += 1
+            try:
+                filter_mask: np.ndarray = predicate(ordered[column])
+            except ValueError as e:
+                # Stored before inputs were validated, e.g. text on a numeric column
+                print(f"Skipped filter {filter.get('id')}: {e}")
+                continue
         else:
-            raise ValueError("Unsupported method")
+            if column not in encoded:
+                encoded[column] = encodeColumn(df, column, positions, cache, key)
+            filter_mask = encoded[column].evaluate(predicate)
+
+        if mask_key is not None:
+            cache.masks.put(mask_key, np.packbits(filter_mask))
+
+        mask &= filter_mask
+
+    if not sort:
+        return df.take(np.flatnonzero(mask))  # Dont destroy original
+
+    for column, _ in sort:
+        if column not in ordered:
+            ordered[column] = sortColumn(df, column, positions, cache, key)
+    rows: np.ndarray = sortRows([(ordered[column], desc) for column, desc in sort])
+    return df.take(rows[mask[rows]])  # Sorted rows that pass every filter
+
+
+def encodeColumn(
+    df: pd.DataFrame,
+    column: int,
+    positions: Optional[dict],
+    cache: Optional[FilterCache],
+    key: tuple,
+) -> EncodedColumn:
+    # Return the encoded values of a sheet column, re-using a cached encoding
+    series: pd.Series = df.iloc[:, column if positions is None else positions[column]]
+    if cache is None:
+        return EncodedColumn(series)
+
+    encoding_key: tuple = (*key, column)
+    encoded: EncodedColumn = cache.encodings.get(encoding_key)
+    if encoded is None:
+        encoded = EncodedColumn(series)
+        cache.encodings.put(encoding_key, encoded)
+
+    return encoded
+
+
+def sortColumn(
+    df: pd.DataFrame,
+    column: int,
+    positions: Optional[dict],
+    cache: Optional[FilterCache],
+    key: tuple,
+) -> SortedColumn:
+    # Return the sort order of a sheet column, re-using a cached one
+    series: pd.Series = df.iloc[:, column if positions is None else positions[column]]
+    if cache is None:
+        return SortedColumn(series)
+
+    order_key: tuple = (*key, column)
+    ordered: SortedColumn = cache.orders.get(order_key)
+    if ordered is None:
+        ordered = SortedColumn(series)
+        cache.orders.put(order_key, ordered)
 
-    return new_df
+    return ordered
@@ -0,0 +1,180 @@
+# Background ingest of uploaded files
+
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Event, Lock, Thread
+from typing import List, Optional
+from uuid import uuid4
+
+from werkzeug.datastructures import FileStorage
+
+from sqlHelper import DB, JobStatus
+from helperMethods import readFile, describeSheets
+
+
+def parseBlob(path: str, filename: str, ext: str) -> List[dict]:
+    # Runs in a worker process: parse a stored file into the sheets DB.set_sheets stores
+    with open(path, "rb") as file:
+        data: bytes = file.read()
+
+    sheets: dict = readFile(FileStorage(data, filename=filename), ext)
+    if sheets is None:
+        raise ValueError(f"Failed to parse {ext} file")
+
+    return describeSheets(sheets)
+
+
+class IngestQueue:
+    # Parses queued files in a process pool. Jobs are persisted in the DB, a
+    # dispatcher thread claims as many as there are free workers, so jobs queued
+    # before a restart are picked up again once started. Several processes (e.g.
+    # gunicorn workers) share the queue: each claim is leased to its queue and
+    # renewed while it runs, only claims whose lease expired are requeued.
+    def __init__(
+        self,
+        db: DB,
+        workers: int,
+        max_queued: int,
+        poll_interval: float = 1.0,
+        lease: float = 30.0,
+    ):
+        self.db: DB = db
+        self.workers: int = workers
+        self.max_queued: int = max_queued
+        self.poll_interval: float = poll_interval
+        self.lease: float = lease  # Seconds a claim lasts without being renewed
+        self.owner: str = uuid4().hex  # Identifies this queue's claims
+        self.renew_at: float = 0.0
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.running: int = 0  # Files currently being parsed
+        self.lock: Lock = Lock()
+        self.wake: Event = Event()
+        self.stopped: Event = Event()
+        self.thread: Optional[Thread] = None
+
+    def newPool(self) -> ProcessPoolExecutor:
+        # Workers come from a fork server: forking this threaded process could copy
+        # a lock some other thread holds and leave the worker hung on it
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=get_context("forkserver")
+        )
+
+    def start(self):
+        self.pool = self.newPool()
+        self.thread = Thread(target=self.dispatch, name="ingest", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def has_room(self, count: int) -> bool:
+        # Whether count more files fit in the bounded queue
+        return self.db.count_pending_jobs() + count <= self.max_queued
+
+    def submit(self, file_ids: List[int]) -> Optional[int]:
+        # Queue the given files for parsing, return the job id
+        job_id: Optional[int] = self.db.add_job(file_ids)
+        self.wake.set()
+        return job_id
+
+    def heartbeat(self):
+        # Renew this queue's claims and requeue those of processes that stopped
+        # renewing theirs, a few times per lease
+        now: float = time.time()
+        if now < self.renew_at:
+            return
+        self.renew_at = now + self.lease / 3
+
+        with self.lock:
+            running: int = self.running
+        if running:
+            self.db.renew_leases(self.owner, now + self.lease)
+
+        requeued: int = self.db.requeue_expired_jobs(now)
+        if requeued:
+            print(f"Requeued {requeued} interrupted ingest jobs")
+
+    def dispatch(self):
+        while not self.stopped.is_set():
+            self.heartbeat()
+
+            with self.lock:
+                free: int = self.workers - self.running
+            if free > 0:
+                claimed: List[dict] = self.db.claim_jobs(
+                    free, self.owner, time.time() + self.lease
+                )
+                for task in claimed:
+                    try:
+                        self.run(task)
+                    except Exception as e:
+                        self.db.finish_job(
+                            task["job_id"],
+                            task["file_id"],
+                            self.owner,
+                            JobStatus.FAILED,
+                            str(e),
+                        )
+
+            self.wake.wait(self.poll_interval)
+            self.wake.clear()
+
+    def run(self, task: dict):
+        job_id, file_id = task["job_id"], task["file_id"]
+        if task["hash"] is None:
+            self.db.finish_job(
+                job_id, file_id, self.owner, JobStatus.FAILED, "File not found"
+            )
+            return
+
+        if self.db.copy_sheets_from_twin(file_id):
+            # Identical contents were already ingested
+            self.db.finish_job(job_id, file_id, self.owner, JobStatus.DONE)
+            return
+
+        args: tuple = (
+            self.db.store.path(task["hash"]),
+            task["name"] + task["ext"],
+            task["ext"],
+        )
+        try:
+            future: Future = self.pool.submit(parseBlob, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory), replace the pool and retry once
+            self.pool = self.newPool()
+            future = self.pool.submit(parseBlob, *args)
+
+        with self.lock:
+            self.running += 1
+        future.add_done_callback(lambda future: self.finished(task, future))
+
+    def finished(self, task: dict, future: Future):
+        status, error = JobStatus.FAILED, None
+        try:
+            ok, msg = self.db.set_sheets(
+                task["file_id"], future.result(), task["version"]
+            )
+            print(msg)
+            if ok:
+                status = JobStatus.DONE
+            else:
+                error = msg
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            with self.lock:
+                self.running -= 1
+            self.wake.set()
+
+        if self.stopped.is_set() and future.cancelled():
+            return  # Left running, it's requeued once its lease expires
+
+        if not self.db.finish_job(
+            task["job_id"], task["file_id"], self.owner, status, error
+        ):
+            print(f"Lost the claim on file {task['file_id']} of job {task['job_id']}")
@@ -0,0 +1,216 @@
+# Per-request phase timings (Server-Timing) and Prometheus metrics
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from flask import Flask, Response, g, has_request_context, request
+
+# Upper bounds in seconds of the latency histogram buckets, Prometheus' defaults
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def formatLabels(labels: dict) -> str:
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels.values()
+    )
+    return ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+class RequestMetrics:
+    # Times the phases of each request (db, parse, filter, serialize), sends them in a
+    # Server-Timing header and aggregates them into histograms per endpoint and phase.
+    # Phases finished after the headers went out (streamed bodies) only reach the
+    # histograms.
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: Tuple[float, ...] = buckets
+        self.histograms: Dict[Tuple[str, str], Histogram] = dict()
+        self.requests: Dict[Tuple[str, int], int] = dict()  # (endpoint, status)
+        self.bytes_sent: Dict[str, int] = dict()
+        self.in_flight: int = 0
+        # name -> (help, collect), collect returns [(labels, value)]
+        self.gauges: Dict[
+            str, Tuple[str, Callable[[], List[Tuple[dict, float]]]]
+        ] = dict()
+        self.lock: Lock = Lock()
+
+    def init_app(self, app: Flask):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def gauge(
+        self, name: str, help: str, collect: Callable[[], List[Tuple[dict, float]]]
+    ):
+        # Register a gauge whose labeled values are collected on every scrape
+        self.gauges[name] = (help, collect)
+
+    @contextmanager
+    def phase(self, name: str):
+        # Time a block of the current request as the given phase, no-op outside requests
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        if not has_request_context() or "timings" not in g:
+            return
+        with self.lock:
+            g.timings[name] = g.timings.get(name, 0.0) + seconds
+
+    def start_request(self):
+        g.timings = dict()
+        g.request_start = time.perf_counter()
+        with self.lock:
+            self.in_flight += 1
+
+    def finish_request(self, response: Response) -> Response:
+        if "request_start" not in g:
+            return response  # An earlier before_request hook answered
+
+        endpoint: str = request.endpoint or "unmatched"
+        timings: dict = g.timings
+        start: float = g.request_start
+        status: int = response.status_code
+
+        entries: List[str] = [
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+        ]
+        entries.append(f"total;dur={(time.perf_counter() - start) * 1000:.1f}")
+        if not response.is_streamed and response.content_length is not None:
+            entries.append(f'sent;desc="{response.content_length} bytes"')
+        response.headers["Server-Timing"] = ", ".join(entries)
+
+        if not response.is_streamed:
+            self.observe(endpoint, status, timings, start, response.content_length or 0)
+            return response
+
+        # Time producing the body and count its bytes as it's sent, observed once the
+        # server closes the response (also if the client went away mid-body)
+        body: Iterator[bytes] = iter(response.response)
+        streamed: dict = {"serialize": 0.0, "sent": 0}
+
+        def stream() -> Iterator[bytes]:
+            while True:
+                started: float = time.perf_counter()
+                try:
+                    chunk = next(body)
+                except StopIteration:
+                    return
+                finally:
+                    streamed["serialize"] += time.perf_counter() - started
+                streamed["sent"] += len(chunk)
+                yield chunk
+
+        def finish():
+            timings["serialize"] = timings.get("serialize", 0.0) + streamed["serialize"]
+            self.observe(endpoint, status, timings, start, streamed["sent"])
+
+        response.response = stream()
+        response.call_on_close(finish)
+        return response
+
+    def observe(
+        self, endpoint: str, status: int, timings: dict, start: float, sent: int
+    ):
+        total: float = time.perf_counter() - start
+        with self.lock:
+            self.in_flight -= 1
+            for name, seconds in [*timings.items(), ("total", total)]:
+                key = (endpoint, name)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.buckets)
+                self.histograms[key].observe(seconds)
+
+            self.requests[(endpoint, status)] = (
+                self.requests.get((endpoint, status), 0) + 1
+            )
+            self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + sent
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines: List[str] = list()
+        with self.lock:
+            lines += [
+                "# HELP http_request_phase_seconds Time spent per request phase",
+                "# TYPE http_request_phase_seconds histogram",
+            ]
+            for (endpoint, phase), histogram in sorted(self.histograms.items()):
+                labels = {"endpoint": endpoint, "phase": phase}
+                cumulative: int = 0
+                for bound, count in zip(
+                    [*map(str, histogram.buckets), "+Inf"], histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f"http_request_phase_seconds_bucket{{{formatLabels({**labels, 'le': bound})}}} {cumulative}"
+                    )
+                lines.append(
+                    f"http_request_phase_seconds_sum{{{formatLabels(labels)}}} {histogram.sum}"
+                )
+                lines.append(
+                    f"http_request_phase_seconds_count{{{formatLabels(labels)}}} {histogram.count}"
+                )
+
+            lines += [
+                "# HELP http_requests_total Finished requests",
+                "# TYPE http_requests_total counter",
+            ]
+            for (endpoint, status), count in sorted(self.requests.items()):
+                labels = {"endpoint": endpoint, "status": status}
+                lines.append(f"http_requests_total{{{formatLabels(labels)}}} {count}")
+
+            lines += [
+                "# HELP http_response_bytes_total Response body bytes sent",
+                "# TYPE http_response_bytes_total counter",
+            ]
+            for endpoint, sent in sorted(self.bytes_sent.items()):
+                labels = {"endpoint": endpoint}
+                lines.append(
+                    f"http_response_bytes_total{{{formatLabels(labels)}}} {sent}"
+                )
+
+            lines += [
+                "# HELP http_requests_in_flight Requests being handled",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+            ]
+
+        for name, (help, collect) in self.gauges.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            for labels, value in collect():
+                if labels:
+                    lines.append(f"{name}{{{formatLabels(labels)}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
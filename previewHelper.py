@@ -0,0 +1,215 @@
+# Streaming readers of the first rows of a single sheet, for previews that
+# shouldn't wait for the whole workbook to be parsed
+
+from __future__ import annotations
+
+import os
+from io import BytesIO
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional
+from xml.etree.ElementTree import fromstring, iterparse
+from zipfile import ZipFile
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PREVIEW_ROWS: int = 200  # Default rows of a preview
+PREVIEW_MAX_REPEAT: int = 1024  # Cap on ods run-length repeats, trailing runs are huge
+
+ODS_TABLE: str = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+ODS_OFFICE: str = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+XLSX_MAIN: str = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+XLSX_RELATIONSHIPS: str = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+)
+
+
+def frameFromRows(rows: Iterable[tuple], limit: int) -> pd.DataFrame:
+    # Build a DataFrame like pd.read_excel would: the first row is the header,
+    # unnamed columns are "Unnamed: i" and repeated names get a ".n" suffix
+    import pandas as pd
+
+    iterator: Iterator[tuple] = iter(rows)
+    header: Optional[tuple] = next(iterator, None)
+    if header is None:
+        return pd.DataFrame()
+
+    body: List[list] = list()
+    blank: int = 0  # Empty rows are only kept if data follows them
+    for row in iterator:
+        if len(body) >= limit:
+            break
+        if any(value is not None for value in row):
+            body += [[] for _ in range(blank)] + [list(row)]
+            blank = 0
+        else:
+            blank += 1
+    body = body[:limit]
+
+    width: int = max([len(header), *map(len, body)])
+    columns: List[str] = list()
+    seen: dict = dict()
+    for index in range(width):
+        value: Any = header[index] if index < len(header) else None
+        name: str = f"Unnamed: {index}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+
+    body = [row + [None] * (width - len(row)) for row in body]
+    return pd.DataFrame(body, columns=columns).infer_objects()
+
+
+def previewXlsx(data: bytes, sheet: int, rows: int) -> Optional[pd.DataFrame]:
+    # openpyxl's read-only mode parses the sheet's XML lazily, row by row
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        if not 0 <= sheet < len(workbook.worksheets):
+            return None
+        worksheet = workbook.worksheets[sheet]
+        return frameFromRows(worksheet.iter_rows(values_only=True), rows)
+    finally:
+        workbook.close()
+
+
+def odsCellValue(cell) -> Any:
+    import pandas as pd
+
+    kind: Optional[str] = cell.get(f"{{{ODS_OFFICE}}}value-type")
+    if kind in ("float", "percentage", "currency"):
+        value: float = float(cell.get(f"{{{ODS_OFFICE}}}value"))
+        return int(value) if value.is_integer() else value  # As pandas' odf reader
+    if kind == "date":
+        return pd.Timestamp(cell.get(f"{{{ODS_OFFICE}}}date-value"))
+    if kind == "boolean":
+        return cell.get(f"{{{ODS_OFFICE}}}boolean-value") == "true"
+    if kind is None:
+        return None
+    text: str = "\n".join("".join(p.itertext()) for p in cell)  # A line per paragraph
+    return text or None
+
+
+def odsRows(content, sheet: int) -> Iterator[tuple]:
+    # Rows of the sheet-th table of an ods content.xml, parsed incrementally.
+    # Elements are cleared once read, so memory stays bounded by a row.
+    table: str = f"{{{ODS_TABLE}}}table"
+    row_tag: str = f"{{{ODS_TABLE}}}table-row"
+    cell_tags: tuple = (
+        f"{{{ODS_TABLE}}}table-cell",
+        f"{{{ODS_TABLE}}}covered-table-cell",
+    )
+    tables: int = -1
+    cells: list = list()
+
+    for event, element in iterparse(content, events=("start", "end")):
+        if event == "start":
+            if element.tag == table:
+                tables += 1
+            continue
+
+        if tables != sheet:
+            if element.tag == row_tag:
+                element.clear()  # Skipped tables aren't kept in memory either
+            continue
+
+        if element.tag in cell_tags:
+            repeat: int = int(element.get(f"{{{ODS_TABLE}}}number-columns-repeated", 1))
+            cells += [odsCellValue(element)] * min(repeat, PREVIEW_MAX_REPEAT)
+        elif element.tag == row_tag:
+            while cells and cells[-1] is None:
+                cells.pop()  # Trailing empty cells pad the row to the sheet's width
+            repeat = int(element.get(f"{{{ODS_TABLE}}}number-rows-repeated", 1))
+            for _ in range(min(repeat, PREVIEW_MAX_REPEAT)):
+                yield tuple(cells)
+            cells = list()
+            element.clear()
+        elif element.tag == table:
+            return
+
+
+def previewOds(data: bytes, sheet: int, rows: int) -> Optional[pd.DataFrame]:
+    # odfpy builds the whole document tree before giving out a row, so the
+    # table's XML is streamed directly instead
+    with ZipFile(BytesIO(data)) as archive, archive.open("content.xml") as content:
+        return frameFromRows(odsRows(content, sheet), rows)
+
+
+def previewCSV(data: bytes, sheet: int, rows: int) -> Optional[pd.DataFrame]:
+    from csvHelper import readCSVHead
+
+    if sheet != 0:
+        return None
+    return readCSVHead(BytesIO(data), rows)
+
+
+previewers: dict = {".xlsx": previewXlsx, ".ods": previewOds, ".csv": previewCSV}
+
+
+def readPreview(
+    data: bytes, filename: str, sheet: int, rows: int
+) -> Optional[pd.DataFrame]:
+    # First rows of a sheet of a stored file, None if it has no such sheet.
+    # Runs in a worker process in the async mode, so it takes plain bytes.
+    ext: str = os.path.splitext(filename)[1].lower()
+    previewer = previewers.get(ext)
+    if previewer is None:
+        return None
+
+    try:
+        return previewer(data, int(sheet), int(rows))
+    except Exception as e:
+        print(f"Failed to preview {filename}: {e}")
+        return None
+
+
+def countXlsx(data: bytes) -> int:
+    # Worksheets listed in the workbook's index, chart sheets aren't read as sheets
+    with ZipFile(BytesIO(data)) as archive:
+        workbook = fromstring(archive.read("xl/workbook.xml"))
+        relations = fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+
+    kinds: dict = {rel.get("Id"): rel.get("Type", "") for rel in relations}
+    return sum(
+        kinds.get(sheet.get(f"{{{XLSX_RELATIONSHIPS}}}id"), "").endswith("/worksheet")
+        for sheet in workbook.iter(f"{{{XLSX_MAIN}}}sheet")
+    )
+
+
+def countOds(data: bytes) -> int:
+    # Tables of content.xml, streamed and cleared row by row like odsRows
+    table: str = f"{{{ODS_TABLE}}}table"
+    row_tag: str = f"{{{ODS_TABLE}}}table-row"
+    tables: int = 0
+    with ZipFile(BytesIO(data)) as archive, archive.open("content.xml") as content:
+        for event, element in iterparse(content, events=("start", "end")):
+            if event == "start":
+                tables += element.tag == table
+            elif element.tag == row_tag:
+                element.clear()
+    return tables
+
+
+def countCSV(data: bytes) -> int:
+    return 1
+
+
+counters: dict = {".xlsx": countXlsx, ".ods": countOds, ".csv": countCSV}
+
+
+def countSheets(data: bytes, filename: str) -> Optional[int]:
+    # Sheets of a stored file without parsing them, None if it can't be read.
+    # Runs in a worker process in the async mode, so it takes plain bytes.
+    ext: str = os.path.splitext(filename)[1].lower()
+    counter = counters.get(ext)
+    if counter is None:
+        return None
+
+    try:
+        return counter(data)
+    except Exception as e:
+        print(f"Failed to count the sheets of {filename}: {e}")
+        return None
@@ -0,0 +1,136 @@
+# On-demand cProfile of single requests
+
+import cProfile
+import os
+import pstats
+import re
+import time
+from io import StringIO
+from threading import Lock
+from typing import List, Optional
+
+from flask import Flask, Response, g, request
+
+PROFILE_EXT: str = ".prof"
+PROFILE_SORT_KEYS: frozenset = frozenset(pstats.Stats.sort_arg_dict_default)
+
+
+def reportOptions(args) -> tuple:
+    # sort, limit and match of a text report from query args, ValueError if invalid
+    sort: str = args.get("sort", "cumulative")
+    if sort not in PROFILE_SORT_KEYS:
+        keys: str = ", ".join(sorted(PROFILE_SORT_KEYS))
+        raise ValueError(f"Invalid sort, expected one of {keys}")
+
+    try:
+        limit: int = int(args.get("limit", 50))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError("Invalid limit, expected a positive integer")
+
+    match: Optional[str] = args.get("match") or None
+    if match is not None:
+        try:
+            re.compile(match)
+        except re.error as e:
+            raise ValueError(f"Invalid match: {e}") from None
+
+    return sort, limit, match
+
+
+class RequestProfiler:
+    # Profiles requests that carry the trigger header, when enabled in the config.
+    # Each profile is saved as a pstats dump labeled with the endpoint, file id and
+    # sheet, only the newest keep of them are kept. The hooks are only registered
+    # when enabled, so otherwise requests pay nothing.
+    def __init__(self, directory: os.PathLike, keep: int, header: str = "X-Profile"):
+        self.directory: str = os.path.abspath(directory)
+        self.keep: int = keep
+        self.header: str = header
+        self.lock: Lock = Lock()
+
+    def init_app(self, app: Flask):
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        if request.headers.get(self.header) != "1":
+            return
+
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def finish_request(self, response: Response) -> Response:
+        profiler: Optional[cProfile.Profile] = g.pop("profiler", None)
+        if profiler is None:
+            return response
+
+        name: str = self.label()
+        if response.is_streamed:
+            # Keep profiling while the body is produced, save once it's sent
+            def save():
+                profiler.disable()
+                self.save(profiler, name)
+
+            response.call_on_close(save)
+        else:
+            profiler.disable()
+            self.save(profiler, name)
+
+        response.headers["X-Profile-Name"] = name
+        return response
+
+    def label(self) -> str:
+        # e.g. 20240101T120000.123456-get_sheet-file12-sheet0
+        data: dict = dict(request.args)
+        json_data = request.get_json(silent=True)
+        if isinstance(json_data, dict):
+            data.update(json_data)
+
+        parts: List[str] = [
+            time.strftime("%Y%m%dT%H%M%S") + f".{time.time_ns() // 1000 % 1000000:06d}",
+            request.endpoint or "unmatched",
+        ]
+        for key, tag in (("fileId", "file"), ("sheet", "sheet")):
+            if key in data:
+                parts.append(f"{tag}{data[key]}")
+
+        return re.sub(r"[^\w.-]", "_", "-".join(parts))
+
+    def save(self, profiler: cProfile.Profile, name: str):
+        profiler.dump_stats(os.path.join(self.directory, name + PROFILE_EXT))
+        with self.lock:
+            for stale in self.list()[self.keep :]:
+                try:
+                    os.remove(self.path(stale["name"]))
+                except OSError:
+                    pass
+
+    def list(self) -> List[dict]:
+        # Saved profiles, newest first
+        profiles: List[dict] = [
+            {
+                "name": entry.name[: -len(PROFILE_EXT)],
+                "size": entry.stat().st_size,
+                "created": entry.stat().st_mtime,
+            }
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(PROFILE_EXT)
+        ]
+        return sorted(profiles, key=lambda profile: profile["name"], reverse=True)
+
+    def path(self, name: str) -> Optional[str]:
+        # Path of a saved profile, None if the name isn't one
+        path: str = os.path.join(self.directory, os.path.basename(name) + PROFILE_EXT)
+        return path if os.path.isfile(path) else None
+
+    def text(self, name: str, sort: str = "cumulative", limit: int = 50, match=None):
+        # Readable report of a saved profile, optionally only functions whose
+        # file:line(name) matches the regex match
+        output = StringIO()
+        stats = pstats.Stats(self.path(name), stream=output)
+        stats.strip_dirs().sort_stats(sort)
+        stats.print_stats(*([match] if match else []), limit)
+        return output.getvalue()
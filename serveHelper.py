@@ -0,0 +1,144 @@
+# Concurrency limits and executors of the async serving mode
+
+from __future__ import annotations
+
+from contextvars import copy_context
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from flask import Response, jsonify, make_response
+from werkzeug.datastructures import FileStorage
+
+from helperMethods import readFile, encoders
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def parseFile(data: bytes, filename: str) -> Optional[dict]:
+    # Runs in a worker process, FileStorage itself can't be pickled
+    return readFile(FileStorage(data, filename=filename))
+
+
+def encodeDF(df: pd.DataFrame, mimetype: str) -> bytes:
+    # Runs in a worker process: encode a whole sheet with the encoder of mimetype
+    encoder, _ = encoders[mimetype]
+    return b"".join(encoder(df))
+
+
+class ConcurrencyLimiter:
+    # Caps how many requests of each endpoint class run at once, so e.g. cheap
+    # metadata requests never wait behind heavy sheet renders. A request that
+    # can't get a slot within wait seconds is answered with 503. A streamed response
+    # keeps its slot until the body is sent, that's where most of its work happens.
+    # Views are decorated at import, the limits are set once the app is configured.
+    def __init__(self, limits: Optional[Dict[str, int]] = None, wait: float = 30):
+        self.lock: Lock = Lock()
+        self.configure(limits or dict(), wait)
+
+    def configure(self, limits: Dict[str, int], wait: float):
+        with self.lock:
+            self.limits: Dict[str, int] = dict(limits)
+            self.wait: float = wait
+            self.semaphores: Dict[str, BoundedSemaphore] = {
+                name: BoundedSemaphore(limit) for name, limit in limits.items()
+            }
+            self.active: Dict[str, int] = {name: 0 for name in limits}
+            self.rejected: Dict[str, int] = {name: 0 for name in limits}
+
+    def limit(self, endpoint_class: str) -> Callable:
+        # Decorator for views, placed below @routes.route. Classes without a
+        # configured limit run unlimited.
+        def decorator(view: Callable) -> Callable:
+            @wraps(view)
+            def limited(*args, **kwargs):
+                semaphore: Optional[BoundedSemaphore] = self.semaphores.get(
+                    endpoint_class
+                )
+                if semaphore is None:
+                    return view(*args, **kwargs)
+
+                if not semaphore.acquire(timeout=self.wait):
+                    with self.lock:
+                        self.rejected[endpoint_class] += 1
+                    return (
+                        jsonify({"error": "Server busy, try again later"}),
+                        503,
+                        {"Retry-After": "1"},
+                    )
+
+                with self.lock:
+                    self.active[endpoint_class] += 1
+
+                def release():
+                    with self.lock:
+                        self.active[endpoint_class] -= 1
+                    semaphore.release()
+
+                try:
+                    response: Response = make_response(view(*args, **kwargs))
+                except BaseException:
+                    release()
+                    raise
+
+                if response.is_streamed:
+                    response.call_on_close(release)  # Also if the client went away
+                else:
+                    release()
+                return response
+
+            return limited
+
+        return decorator
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                name: {
+                    "limit": self.limits[name],
+                    "active": self.active[name],
+                    "rejected": self.rejected[name],
+                }
+                for name in self.limits
+            }
+
+
+class Offloader:
+    # Runs blocking calls on a thread pool and CPU-bound pandas work on a process
+    # pool. When disabled (the default sync mode) every call runs inline.
+    def __init__(self, enabled: bool, threads: int, processes: int):
+        self.enabled: bool = enabled
+        self.threads: Optional[ThreadPoolExecutor] = None
+        self.processes: Optional[ProcessPoolExecutor] = None
+        if enabled:
+            self.threads = ThreadPoolExecutor(threads, thread_name_prefix="offload")
+            # A fork server, as forking the threaded server could copy a held lock
+            self.processes = ProcessPoolExecutor(
+                processes, mp_context=get_context("forkserver")
+            )
+
+    def gather(self, *calls: Callable[[], Any]) -> List[Any]:
+        # Run independent blocking calls (e.g. DB queries) concurrently, in order
+        if not self.enabled or len(calls) < 2:
+            return [call() for call in calls]
+
+        # Each call sees the caller's context, e.g. Flask's request and g
+        futures: List[Future] = [
+            self.threads.submit(copy_context().run, call) for call in calls
+        ]
+        return [future.result() for future in futures]
+
+    def cpu(self, fn: Callable, *args) -> Any:
+        # Run a picklable top-level function in a worker process
+        if not self.enabled:
+            return fn(*args)
+
+        return self.processes.submit(fn, *args).result()
+
+    def shutdown(self):
+        if self.enabled:
+            self.threads.shutdown(wait=False)
+            self.processes.shutdown(wait=False, cancel_futures=True)
@@ -1,23 +1,37 @@
+import json
 from sqlite3 import Cursor, Connection, Error, connect
 from enum import Enum
-from typing import Optional, List, Tuple, List, Generator
+from typing import Optional, List, Tuple, List, Generator, Callable, Dict
 
 import os
+import time
+from io import BytesIO
 from werkzeug.datastructures import FileStorage
 from contextlib import contextmanager
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+
+from blobHelper import BlobStore
 
 
 class Tables(Enum):
     File = "File"
     Filter = "Filter"
     FileFilter = "FileFilter"
+    SheetData = "SheetData"
+    SheetCatalog = "SheetCatalog"
+    Blob = "Blob"
+    Job = "Job"
+    JobFile = "JobFile"
 
 
 class FileColumns(Enum):
     ID = "id"
     NAME = "name"
     EXT = "ext"
-    BLOB = "blob"
+    BLOB = "blob"  # Legacy, contents now live in the blob store
+    VERSION = "version"
+    HASH = "hash"
 
 
 class FilterColumns(Enum):
@@ -25,6 +39,7 @@ class FilterColumns(Enum):
     METHOD = "method"
     INPUT = "input"
     ENABLED = "enabled"
+    VERSION = "version"
 
 
 class FileFilterColumns(Enum):
@@ -34,27 +49,152 @@ class FileFilterColumns(Enum):
     COLUMN = "column"
 
 
+class SheetDataColumns(Enum):
+    FILE_ID = "file_id"
+    SHEET = "sheet"
+    NAME = "name"
+    DATA = "data"
+
+
+class SheetCatalogColumns(Enum):
+    FILE_ID = "file_id"
+    SHEET = "sheet"
+    NAME = "name"
+    ROWS = "rows"
+    COLUMNS = "columns"
+    COLUMN_NAMES = "column_names"
+    DTYPES = "dtypes"
+
+
+class BlobColumns(Enum):
+    HASH = "hash"
+    SIZE = "size"
+    REFCOUNT = "refcount"
+
+
+class JobColumns(Enum):
+    ID = "id"
+    CREATED = "created"
+
+
+class JobFileColumns(Enum):
+    JOB_ID = "job_id"
+    FILE_ID = "file_id"
+    VERSION = "version"  # File version the job parses, stale if the file changed
+    STATUS = "status"
+    ERROR = "error"
+    OWNER = "owner"  # Ingest queue that claimed the file
+    LEASE = "lease"  # Time its claim expires unless renewed
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# Applied to every new connection, see https://www.sqlite.org/pragma.html
+DEFAULT_PRAGMAS: dict = {
+    "journal_mode": "WAL",  # Readers don't block the writer and vice versa
+    "synchronous": "NORMAL",  # Safe with WAL, fsyncs only at checkpoints
+    "cache_size": -64 * 1024,  # Negative values are in KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,  # Milliseconds a writer waits for the write lock
+}
+
+
 class DB:
-    def __init__(self, db_path: os.PathLike):
+    def __init__(
+        self,
+        db_path: os.PathLike,
+        store: Optional[BlobStore] = None,
+        pool_size: int = 8,
+        pragmas: Optional[dict] = None,
+    ):
         self.db_path = db_path
+        # File contents are kept on disk by hash, next to the database by default
+        self.store: BlobStore = store or BlobStore(
+            os.path.splitext(db_path)[0] + "_blobs"
+        )
+        # Idle connections are re-used, at most pool_size of them are kept open
+        self.pool_size: int = pool_size
+        self.pool: Queue = Queue()
+        self.pragmas: dict = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.file_listeners: List[Callable[[Optional[int]], None]] = list()
+        self.query_listeners: List[Callable[[float], None]] = list()
         self.init_tables()
+        self.migrate_blobs()
+        self.collect_garbage()
+
+    def subscribe(self, listener: Callable[[Optional[int]], None]):
+        # Register a callback invoked with a file id whenever that file's content
+        # changes or is deleted, or with None when every file is affected
+        self.file_listeners.append(listener)
+
+    def notify_file_changed(self, file_id: Optional[int]):
+        for listener in self.file_listeners:
+            listener(None if file_id is None else int(file_id))
+
+    def observe_queries(self, listener: Callable[[float], None]):
+        # Register a callback invoked with the seconds each borrowed connection was
+        # held, i.e. the time spent on a DB call
+        self.query_listeners.append(listener)
+
+    def connect(self) -> Connection:
+        # Open a connection in autocommit mode, transactions are begun explicitly
+        conn: Connection = connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        return conn
+
+    def release(self, conn: Connection):
+        # Return a connection to the pool, closing it if the pool is full
+        if self.pool.qsize() >= self.pool_size:
+            conn.close()
+            return
+        self.pool.put(conn)
+
+    def close(self):
+        # Close every pooled connection
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Empty:
+                return
 
     @contextmanager
-    def connection(self) -> Generator[Connection, None, None]:
-        conn: Connection = connect(self.db_path)
+    def connection(self, readonly: bool = False) -> Generator[Connection, None, None]:
+        # Borrow a pooled connection. Writes run in a transaction, reads don't start
+        # one, so under WAL they never wait for (or block) a writer. Write transactions
+        # take the write lock up front: a deferred one that reads first can't wait for
+        # it later and fails with "database is locked" if another writer committed.
+        start: float = time.perf_counter()
+        try:
+            conn: Connection = self.pool.get_nowait()
+        except Empty:
+            conn = self.connect()
+
         try:
-            conn.execute("BEGIN TRANSACTION")  # Begin transaction
+            if not readonly:
+                conn.execute("BEGIN IMMEDIATE")  # Begin transaction
             yield conn
-        except Error as e:
-            conn.rollback()  # Rollback changes if an exception occurs
-            raise e  # Re-raise the exception
+            if conn.in_transaction:
+                conn.commit()  # Only if the block completed
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()  # Rollback changes on any exception, not only SQL ones
+            raise
         finally:
-            conn.commit()
-            conn.close()
+            self.release(conn)
+            for listener in self.query_listeners:
+                listener(time.perf_counter() - start)
 
     @contextmanager
-    def cursor(self) -> Generator[Cursor, None, None]:
-        with self.connection() as conn:
+    def cursor(self, readonly: bool = False) -> Generator[Cursor, None, None]:
+        with self.connection(readonly) as conn:
             cursor: Cursor = conn.cursor()
             try:
                 yield cursor
@@ -70,7 +210,52 @@ class DB:
                             ({FileColumns.ID.value} INTEGER PRIMARY KEY AUTOINCREMENT,
                             {FileColumns.NAME.value} TEXT,
                             {FileColumns.EXT.value} TEXT,
-                            {FileColumns.BLOB.value} BLOB)"""
+                            {FileColumns.BLOB.value} BLOB,
+                            {FileColumns.VERSION.value} INTEGER DEFAULT 0,
+                            {FileColumns.HASH.value} TEXT)"""
+            )
+
+            # Databases created before the version / hash columns were introduced
+            self.add_missing_column(
+                c, Tables.File, FileColumns.VERSION, "INTEGER DEFAULT 0"
+            )
+            self.add_missing_column(c, Tables.File, FileColumns.HASH, "TEXT")
+            c.execute(
+                f"""CREATE INDEX IF NOT EXISTS {Tables.File.value}_{FileColumns.HASH.value}
+                ON {Tables.File.value}({FileColumns.HASH.value})"""
+            )
+
+            # Create Job tables, background ingest jobs and the files each one parses
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {Tables.Job.value}
+                            ({JobColumns.ID.value} INTEGER PRIMARY KEY AUTOINCREMENT,
+                            {JobColumns.CREATED.value} REAL)"""
+            )
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {Tables.JobFile.value}
+                            ({JobFileColumns.JOB_ID.value} INTEGER,
+                            {JobFileColumns.FILE_ID.value} INTEGER,
+                            {JobFileColumns.VERSION.value} INTEGER,
+                            {JobFileColumns.STATUS.value} TEXT,
+                            {JobFileColumns.ERROR.value} TEXT,
+                            {JobFileColumns.OWNER.value} TEXT,
+                            {JobFileColumns.LEASE.value} REAL,
+                            FOREIGN KEY({JobFileColumns.JOB_ID.value}) REFERENCES {Tables.Job.value}({JobColumns.ID.value}),
+                            UNIQUE({JobFileColumns.JOB_ID.value}, {JobFileColumns.FILE_ID.value}))"""
+            )
+            self.add_missing_column(c, Tables.JobFile, JobFileColumns.OWNER, "TEXT")
+            self.add_missing_column(c, Tables.JobFile, JobFileColumns.LEASE, "REAL")
+            c.execute(
+                f"""CREATE INDEX IF NOT EXISTS {Tables.JobFile.value}_{JobFileColumns.STATUS.value}
+                ON {Tables.JobFile.value}({JobFileColumns.STATUS.value})"""
+            )
+
+            # Create Blob table, reference counts of the contents in the blob store
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {Tables.Blob.value}
+                            ({BlobColumns.HASH.value} TEXT PRIMARY KEY,
+                            {BlobColumns.SIZE.value} INTEGER,
+                            {BlobColumns.REFCOUNT.value} INTEGER)"""
             )
 
             # Create Filter table
@@ -79,7 +264,13 @@ class DB:
                             ({FilterColumns.ID.value} INTEGER PRIMARY KEY AUTOINCREMENT,
                             {FilterColumns.METHOD.value} TEXT,
                             {FilterColumns.INPUT.value} TEXT,
-                            {FilterColumns.ENABLED.value} INTEGER)"""
+                            {FilterColumns.ENABLED.value} INTEGER,
+                            {FilterColumns.VERSION.value} INTEGER DEFAULT 0)"""
+            )
+
+            # Databases created before the filter version column was introduced
+            self.add_missing_column(
+                c, Tables.Filter, FilterColumns.VERSION, "INTEGER DEFAULT 0"
             )
 
             # Create Relationship table (Junction table)
@@ -94,25 +285,224 @@ class DB:
                             UNIQUE({FileFilterColumns.FILE_ID.value}, {FileFilterColumns.FILTER_ID.value}))"""
             )
 
+            # Create SheetData table, a columnar (Parquet) copy of every sheet of a file
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {Tables.SheetData.value}
+                            ({SheetDataColumns.FILE_ID.value} INTEGER,
+                            {SheetDataColumns.SHEET.value} INTEGER,
+                            {SheetDataColumns.NAME.value} TEXT,
+                            {SheetDataColumns.DATA.value} BLOB,
+                            FOREIGN KEY({SheetDataColumns.FILE_ID.value}) REFERENCES {Tables.File.value}({FileColumns.ID.value}),
+                            UNIQUE({SheetDataColumns.FILE_ID.value}, {SheetDataColumns.SHEET.value}))"""
+            )
+
+            # Create SheetCatalog table, per sheet metadata so counts and headers need no parsing.
+            # column_names and dtypes hold JSON lists.
+            c.execute(
+                f"""CREATE TABLE IF NOT EXISTS {Tables.SheetCatalog.value}
+                            ({SheetCatalogColumns.FILE_ID.value} INTEGER,
+                            {SheetCatalogColumns.SHEET.value} INTEGER,
+                            {SheetCatalogColumns.NAME.value} TEXT,
+                            {SheetCatalogColumns.ROWS.value} INTEGER,
+                            {SheetCatalogColumns.COLUMNS.value} INTEGER,
+                            {SheetCatalogColumns.COLUMN_NAMES.value} TEXT,
+                            {SheetCatalogColumns.DTYPES.value} TEXT,
+                            FOREIGN KEY({SheetCatalogColumns.FILE_ID.value}) REFERENCES {Tables.File.value}({FileColumns.ID.value}),
+                            UNIQUE({SheetCatalogColumns.FILE_ID.value}, {SheetCatalogColumns.SHEET.value}))"""
+            )
+
+    def add_missing_column(
+        self, c: Cursor, table: Tables, column: Enum, definition: str
+    ):
+        # Add a column to an existing table if it is not there yet
+        c.execute(f"PRAGMA table_info({table.value})")
+        existing: set = {row[1] for row in c.fetchall()}
+        if column.value not in existing:
+            c.execute(
+                f"ALTER TABLE {table.value} ADD COLUMN {column.value} {definition}"
+            )
+
+    def migrate_blobs(self):
+        # Move contents stored in the File table (before the blob store existed)
+        # into the blob store, one file per transaction
+        with self.cursor() as c:
+            c.execute(
+                f"""SELECT {FileColumns.ID.value} FROM {Tables.File.value}
+                WHERE {FileColumns.HASH.value} IS NULL"""
+            )
+            file_ids: list = [file_id for file_id, *_ in c.fetchall()]
+
+        for file_id in file_ids:
+            with self.cursor() as c:
+                c.execute(
+                    f"""SELECT {FileColumns.BLOB.value} IS NULL FROM {Tables.File.value}
+                    WHERE {FileColumns.ID.value} = ?""",
+                    (file_id,),
+                )
+                (is_empty,) = c.fetchone()
+                if is_empty:
+                    hash, size, tmp_path = self.store.stage(BytesIO(b""))
+                else:
+                    with c.connection.blobopen(
+                        Tables.File.value,
+                        FileColumns.BLOB.value,
+                        file_id,
+                        readonly=True,
+                    ) as blob:
+                        hash, size, tmp_path = self.store.stage(blob)
+
+                c.execute(
+                    f"""UPDATE {Tables.File.value}
+                    SET {FileColumns.HASH.value} = ?,
+                        {FileColumns.BLOB.value} = NULL
+                    WHERE {FileColumns.ID.value} = ?""",
+                    (hash, file_id),
+                )
+                self.reference_blob(c, hash, size, tmp_path)
+
+        if file_ids:
+            print(f"Moved {len(file_ids)} files into the blob store")
+
+    def collect_garbage(self):
+        # Delete stored contents no file references, e.g. left behind by a crash
+        with self.cursor() as c:
+            # Writing first takes the write lock, so no upload commits content meanwhile
+            c.execute(
+                f"""DELETE FROM {Tables.Blob.value}
+                WHERE {BlobColumns.REFCOUNT.value} <= 0"""
+            )
+            c.execute(f"""SELECT {BlobColumns.HASH.value} FROM {Tables.Blob.value}""")
+            referenced: set = {hash for hash, *_ in c.fetchall()}
+
+            for hash in list(self.store.hashes()):
+                if hash not in referenced:
+                    self.store.delete(hash)
+
+    def reference_blob(self, c: Cursor, hash: str, size: int, tmp_path: str):
+        # Count a new reference to a staged content, moving it into the store if new
+        c.execute(
+            f"""INSERT INTO {Tables.Blob.value}
+            ({BlobColumns.HASH.value}, {BlobColumns.SIZE.value}, {BlobColumns.REFCOUNT.value})
+            VALUES (?, ?, 1)
+            ON CONFLICT({BlobColumns.HASH.value})
+            DO UPDATE SET {BlobColumns.REFCOUNT.value} = {BlobColumns.REFCOUNT.value} + 1""",
+            (hash, size),
+        )
+        self.store.commit(hash, tmp_path)
+
+    def release_blobs(self, c: Cursor, hashes: List[str]) -> List[str]:
+        # Drop one reference per given hash, return the hashes no longer referenced.
+        # Their contents are only deleted (delete_blobs) once the transaction
+        # committed, a rollback would leave rows pointing at deleted files.
+        c.executemany(
+            f"""UPDATE {Tables.Blob.value}
+            SET {BlobColumns.REFCOUNT.value} = {BlobColumns.REFCOUNT.value} - 1
+            WHERE {BlobColumns.HASH.value} = ?""",
+            [(hash,) for hash in hashes if hash],
+        )
+        c.execute(
+            f"""SELECT {BlobColumns.HASH.value} FROM {Tables.Blob.value}
+            WHERE {BlobColumns.REFCOUNT.value} <= 0"""
+        )
+        unreferenced: list = [hash for hash, *_ in c.fetchall()]
+        c.execute(
+            f"""DELETE FROM {Tables.Blob.value}
+            WHERE {BlobColumns.REFCOUNT.value} <= 0"""
+        )
+        return unreferenced
+
+    def delete_blobs(self, hashes: List[str]):
+        # Delete the contents of hashes released by a committed transaction. Under
+        # the write lock, so no upload references them meanwhile; contents uploaded
+        # again since they were released are kept.
+        if not hashes:
+            return
+
+        with self.cursor() as c:
+            for hash in hashes:
+                c.execute(
+                    f"""SELECT 1 FROM {Tables.Blob.value}
+                    WHERE {BlobColumns.HASH.value} = ?""",
+                    (hash,),
+                )
+                if c.fetchone() is None:
+                    self.store.delete(hash)
+
     def add_file(self, filename: str, file: FileStorage) -> Tuple[bool, str, int]:
-        # Add the file_blob to database
+        # Add the file to the blob store and its record to database
         filename = os.path.basename(filename)
         name, ext = os.path.splitext(filename)
-        with self.cursor() as c:
-            try:
+        hash, size, tmp_path = self.store.stage(file.stream)
+        try:
+            with self.cursor() as c:
                 c.execute(
                     f"""INSERT INTO {Tables.File.value} 
                     ({FileColumns.NAME.value}, 
                     {FileColumns.EXT.value}, 
-                    {FileColumns.BLOB.value})
+                    {FileColumns.HASH.value})
                     VALUES (?, ?, ?)""",
-                    (name, ext, file.read()),
+                    (name, ext, hash),
                 )
 
                 file_id = c.lastrowid
-                return True, f"Added {name} successfully", int(file_id)
-            except Error as e:
-                return False, f"Failed to add {name}: {e}", None
+                self.reference_blob(c, hash, size, tmp_path)
+        except (Error, OSError) as e:
+            # Rolled back, the staged content isn't referenced
+            self.store.discard(tmp_path)
+            return False, f"Failed to add {name}: {e}", None
+
+        return True, f"Added {name} successfully", int(file_id)
+
+    def add_files(
+        self, files: List[FileStorage], workers: int = 4
+    ) -> List[Tuple[bool, str, Optional[int]]]:
+        # Add many files in a single transaction, return (ok, msg, id) per file.
+        # Contents are hashed and staged into the blob store in parallel first.
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            staged: list = list(pool.map(lambda f: self.store.stage(f.stream), files))
+
+        names: list = [
+            os.path.splitext(os.path.basename(file.filename)) for file in files
+        ]
+        try:
+            with self.cursor() as c:
+                c.executemany(
+                    f"""INSERT INTO {Tables.Blob.value}
+                    ({BlobColumns.HASH.value}, {BlobColumns.SIZE.value}, {BlobColumns.REFCOUNT.value})
+                    VALUES (?, ?, 1)
+                    ON CONFLICT({BlobColumns.HASH.value})
+                    DO UPDATE SET {BlobColumns.REFCOUNT.value} = {BlobColumns.REFCOUNT.value} + 1""",
+                    [(hash, size) for hash, size, _ in staged],
+                )
+                c.executemany(
+                    f"""INSERT INTO {Tables.File.value} 
+                    ({FileColumns.NAME.value}, 
+                    {FileColumns.EXT.value}, 
+                    {FileColumns.HASH.value})
+                    VALUES (?, ?, ?)""",
+                    [
+                        (name, ext, hash)
+                        for (name, ext), (hash, *_) in zip(names, staged)
+                    ],
+                )
+
+                # The write lock is held, so the AUTOINCREMENT ids are consecutive
+                c.execute("SELECT last_insert_rowid()")
+                (last_id,) = c.fetchone()
+                first_id: int = last_id - len(files) + 1
+
+                for hash, _, tmp_path in staged:
+                    self.store.commit(hash, tmp_path)
+        except (Error, OSError) as e:
+            # Rolled back, none of the staged contents are referenced
+            for _, _, tmp_path in staged:
+                self.store.discard(tmp_path)
+            return [(False, f"Failed to add {name}: {e}", None) for name, _ in names]
+
+        return [
+            (True, f"Added {name} successfully", first_id + index)
+            for index, (name, _) in enumerate(names)
+        ]
 
     def add_filter(
         self, method: str, input: str, enabled: bool
@@ -152,26 +542,241 @@ class DB:
             except Error as e:
                 return False, f"Failed to create relationship: {e}"
 
-    def get_file(self, file_id) -> Optional[FileStorage]:
-        # Return file blob as FileStorage
+    def delete_sheets(self, c: Cursor, file_id: Optional[int] = None):
+        # Delete the columnar copies and catalog rows of a file, or of every file if None
+        for table, column in (
+            (Tables.SheetData, SheetDataColumns.FILE_ID),
+            (Tables.SheetCatalog, SheetCatalogColumns.FILE_ID),
+        ):
+            if file_id is None:
+                c.execute(f"""DELETE FROM {table.value}""")
+            else:
+                c.execute(
+                    f"""DELETE FROM {table.value} WHERE {column.value} = ?""",
+                    (int(file_id),),
+                )
+
+    def set_sheets(
+        self, file_id: int, sheets: List[dict], version: Optional[int] = None
+    ) -> Tuple[bool, str]:
+        # Replace the columnar copies and catalog rows of a file's sheets.
+        # sheets is ordered by sheet index, each a dict with the keys
+        # name, data, rows, column_names, dtypes. If version is given nothing is
+        # stored unless the file still has that content version.
+        try:
+            with self.cursor() as c:
+                if version is not None:
+                    c.execute(
+                        f"""SELECT {FileColumns.VERSION.value} FROM {Tables.File.value}
+                        WHERE {FileColumns.ID.value}=?""",
+                        (int(file_id),),
+                    )
+                    row = c.fetchone()
+                    if row is None or int(row[0] or 0) != int(version):
+                        return False, "File changed before its sheets were stored"
+
+                self.delete_sheets(c, file_id)
+                c.executemany(
+                    f"""INSERT INTO {Tables.SheetData.value}
+                    ({SheetDataColumns.FILE_ID.value},
+                    {SheetDataColumns.SHEET.value},
+                    {SheetDataColumns.NAME.value},
+                    {SheetDataColumns.DATA.value})
+                    VALUES (?, ?, ?, ?)""",
+                    [
+                        (int(file_id), index, sheet["name"], sheet["data"])
+                        for index, sheet in enumerate(sheets)
+                    ],
+                )
+                c.executemany(
+                    f"""INSERT INTO {Tables.SheetCatalog.value}
+                    ({SheetCatalogColumns.FILE_ID.value},
+                    {SheetCatalogColumns.SHEET.value},
+                    {SheetCatalogColumns.NAME.value},
+                    {SheetCatalogColumns.ROWS.value},
+                    {SheetCatalogColumns.COLUMNS.value},
+                    {SheetCatalogColumns.COLUMN_NAMES.value},
+                    {SheetCatalogColumns.DTYPES.value})
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    [
+                        (
+                            int(file_id),
+                            index,
+                            sheet["name"],
+                            int(sheet["rows"]),
+                            len(sheet["column_names"]),
+                            json.dumps(sheet["column_names"]),
+                            json.dumps(sheet["dtypes"]),
+                        )
+                        for index, sheet in enumerate(sheets)
+                    ],
+                )
+
+                return True, f"Stored {len(sheets)} sheets successfully"
+        except Error as e:
+            return False, f"Failed to store sheets: {e}"
+
+    def copy_sheets_from_twin(self, file_id) -> bool:
+        # Copy the columnar copies and catalog rows of an already ingested file with
+        # identical contents, return whether one was found
         with self.cursor() as c:
+            c.execute(
+                f"""SELECT twin.{FileColumns.ID.value}
+                    FROM {Tables.File.value} AS file
+                    JOIN {Tables.File.value} AS twin
+                    ON twin.{FileColumns.HASH.value} = file.{FileColumns.HASH.value}
+                    AND twin.{FileColumns.ID.value} != file.{FileColumns.ID.value}
+                    WHERE file.{FileColumns.ID.value} = ? AND EXISTS (
+                        SELECT 1 FROM {Tables.SheetCatalog.value}
+                        WHERE {SheetCatalogColumns.FILE_ID.value} = twin.{FileColumns.ID.value})
+                    LIMIT 1""",
+                (int(file_id),),
+            )
+            row = c.fetchone()
+            if row is None:
+                return False
+
+            twin_id: int = row[0]
+            self.delete_sheets(c, file_id)
+            for table, columns in (
+                (Tables.SheetData, SheetDataColumns),
+                (Tables.SheetCatalog, SheetCatalogColumns),
+            ):
+                copied: str = ", ".join(
+                    column.value for column in columns if column.name != "FILE_ID"
+                )
+                c.execute(
+                    f"""INSERT INTO {table.value} ({columns.FILE_ID.value}, {copied})
+                    SELECT ?, {copied} FROM {table.value}
+                    WHERE {columns.FILE_ID.value} = ?""",
+                    (int(file_id), twin_id),
+                )
+
+            return True
+
+    def get_file(self, file_id) -> Optional[FileStorage]:
+        # Return file contents as FileStorage
+        with self.cursor(readonly=True) as c:
             c.execute(
                 f"""SELECT 
-                    {FileColumns.BLOB.value}, 
+                    {FileColumns.HASH.value}, 
                     {FileColumns.NAME.value},
                     {FileColumns.EXT.value} 
                     FROM {Tables.File.value}
                     WHERE {FileColumns.ID.value}=?""",
                 (int(file_id),),
             )
-            blob, name, ext = c.fetchone()
+            row = c.fetchone()
+            if row is None:
+                return None
+
+            hash, name, ext = row
             return FileStorage(
-                blob, filename=name + ext, content_type="application/octet-stream"
+                self.store.read(hash),
+                filename=name + ext,
+                content_type="application/octet-stream",
+            )
+
+    def get_file_hash(self, file_id) -> Optional[str]:
+        # Return the content hash of a file, None if it doesn't exist
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {FileColumns.HASH.value}
+                    FROM {Tables.File.value}
+                    WHERE {FileColumns.ID.value}=?""",
+                (int(file_id),),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def get_file_version(self, file_id) -> Optional[int]:
+        # Return the content version of a file, None if it doesn't exist
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {FileColumns.VERSION.value}
+                    FROM {Tables.File.value}
+                    WHERE {FileColumns.ID.value}=?""",
+                (int(file_id),),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+            return int(row[0] or 0)
+
+    def get_sheet_data(self, file_id, sheet) -> Optional[bytes]:
+        # Return the columnar copy of a sheet, None if it wasn't generated
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {SheetDataColumns.DATA.value}
+                    FROM {Tables.SheetData.value}
+                    WHERE {SheetDataColumns.FILE_ID.value}=? AND {SheetDataColumns.SHEET.value}=?""",
+                (int(file_id), int(sheet)),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+            return row[0]
+
+    def get_sheet_count(self, file_id) -> Optional[int]:
+        # Return the number of sheets from the catalog, None if the file isn't cataloged
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT COUNT(*)
+                    FROM {Tables.SheetCatalog.value}
+                    WHERE {SheetCatalogColumns.FILE_ID.value}=?""",
+                (int(file_id),),
+            )
+            count, *_ = c.fetchone()
+            return int(count) if count else None
+
+    def get_column_names(self, file_id, sheet) -> Optional[List[str]]:
+        # Return the cataloged column names of a sheet, None if it isn't cataloged
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {SheetCatalogColumns.COLUMN_NAMES.value}
+                    FROM {Tables.SheetCatalog.value}
+                    WHERE {SheetCatalogColumns.FILE_ID.value}=? AND {SheetCatalogColumns.SHEET.value}=?""",
+                (int(file_id), int(sheet)),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+            return json.loads(row[0])
+
+    def get_schema(self, file_id) -> Optional[List[dict]]:
+        # Return the catalog of every sheet of a file, None if the file isn't cataloged
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {SheetCatalogColumns.NAME.value},
+                    {SheetCatalogColumns.ROWS.value},
+                    {SheetCatalogColumns.COLUMNS.value},
+                    {SheetCatalogColumns.COLUMN_NAMES.value},
+                    {SheetCatalogColumns.DTYPES.value}
+                    FROM {Tables.SheetCatalog.value}
+                    WHERE {SheetCatalogColumns.FILE_ID.value}=?
+                    ORDER BY {SheetCatalogColumns.SHEET.value}""",
+                (int(file_id),),
             )
+            rows = c.fetchall()
+            if not rows:
+                return None
+
+            return [
+                {
+                    "name": name,
+                    "rows": int(row_count),
+                    "columns": int(column_count),
+                    "columnNames": json.loads(column_names),
+                    "dtypes": json.loads(dtypes),
+                }
+                for name, row_count, column_count, column_names, dtypes in rows
+            ]
 
     def get_file_name(self, file_id) -> Optional[tuple[str, str]]:
         # Return file name and ext
-        with self.cursor() as c:
+        with self.cursor(readonly=True) as c:
             c.execute(
                 f"""SELECT 
                     {FileColumns.NAME.value},
@@ -183,26 +788,55 @@ class DB:
             name, ext = c.fetchone()
             return name, ext
 
-    def get_all_files(self) -> Optional[List[dict]]:
-        with self.cursor() as c:
+    def get_file_size(self, file_id) -> Optional[int]:
+        # Return the size of a file's contents in bytes, None if it doesn't exist
+        with self.cursor(readonly=True) as c:
             c.execute(
-                f"""SELECT 
-                        {FileColumns.ID.value}, 
-                        {FileColumns.NAME.value},
-                        {FileColumns.EXT.value} ,
-                        {FileColumns.BLOB.value} 
-                        FROM {Tables.File.value}"""
+                f"""SELECT {Tables.Blob.value}.{BlobColumns.SIZE.value}
+                    FROM {Tables.File.value}
+                    LEFT JOIN {Tables.Blob.value}
+                    ON {Tables.File.value}.{FileColumns.HASH.value} = {Tables.Blob.value}.{BlobColumns.HASH.value}
+                    WHERE {Tables.File.value}.{FileColumns.ID.value}=?""",
+                (int(file_id),),
             )
+            row = c.fetchone()
+            if row is None:
+                return None
+            return int(row[0] or 0)
 
-            files: List[dict] = [
-                {"id": id, "name": name, "ext": ext, "blob": blob}
-                for id, name, ext, blob in c.fetchall()
-            ]
+    def iter_file(self, file_id) -> Generator[bytes, None, None]:
+        # Yield a file's contents in chunks from the blob store
+        hash: str = self.get_file_hash(file_id)
+        if hash is not None:
+            yield from self.store.iter(hash)
 
-            return files
+    def get_files_info(self, file_ids: Optional[List[int]] = None) -> List[dict]:
+        # Return id, name, ext and size of the given files (every file if None)
+        # in one query, without reading their contents
+        query: str = f"""SELECT 
+                    {Tables.File.value}.{FileColumns.ID.value}, 
+                    {Tables.File.value}.{FileColumns.NAME.value},
+                    {Tables.File.value}.{FileColumns.EXT.value},
+                    {Tables.Blob.value}.{BlobColumns.SIZE.value}
+                    FROM {Tables.File.value}
+                    LEFT JOIN {Tables.Blob.value}
+                    ON {Tables.File.value}.{FileColumns.HASH.value} = {Tables.Blob.value}.{BlobColumns.HASH.value}"""
+        params: tuple = ()
+        if file_ids is not None:
+            params = tuple(int(file_id) for file_id in file_ids)
+            placeholders: str = ", ".join("?" for _ in params)
+            query += f""" WHERE {Tables.File.value}.{FileColumns.ID.value} IN ({placeholders})"""
+        query += f""" ORDER BY {Tables.File.value}.{FileColumns.ID.value}"""
+
+        with self.cursor(readonly=True) as c:
+            c.execute(query, params)
+            return [
+                {"id": id, "name": name, "ext": ext, "size": int(size or 0)}
+                for id, name, ext, size in c.fetchall()
+            ]
 
     def get_all_file_ids(self) -> Optional[List[int]]:
-        with self.cursor() as c:
+        with self.cursor(readonly=True) as c:
             c.execute(
                 f"""SELECT 
                         {FileColumns.ID.value}
@@ -214,7 +848,7 @@ class DB:
 
     def get_filter(self, filter_id) -> Optional[dict]:
         # Return a json representing filter data
-        with self.cursor() as c:
+        with self.cursor(readonly=True) as c:
             c.execute(
                 f"""SELECT {FilterColumns.INPUT.value}, 
                 {FilterColumns.METHOD.value}, 
@@ -235,11 +869,50 @@ class DB:
             }
             return data
 
+    def get_column_dtype(self, file_id, sheet, column) -> Optional[str]:
+        # Return the cataloged dtype of a sheet column, None if it isn't cataloged
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {SheetCatalogColumns.DTYPES.value}
+                    FROM {Tables.SheetCatalog.value}
+                    WHERE {SheetCatalogColumns.FILE_ID.value}=? AND {SheetCatalogColumns.SHEET.value}=?""",
+                (int(file_id), int(sheet)),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+
+            dtypes: List[str] = json.loads(row[0])
+            return dtypes[int(column)] if 0 <= int(column) < len(dtypes) else None
+
+    def get_filter_dtype(self, filter_id) -> Optional[str]:
+        # Return the cataloged dtype of the column a filter applies to, None if unknown
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {Tables.SheetCatalog.value}.{SheetCatalogColumns.DTYPES.value},
+                    {Tables.FileFilter.value}.{FileFilterColumns.COLUMN.value}
+                    FROM {Tables.FileFilter.value}
+                    JOIN {Tables.SheetCatalog.value}
+                    ON {Tables.SheetCatalog.value}.{SheetCatalogColumns.FILE_ID.value} = {Tables.FileFilter.value}.{FileFilterColumns.FILE_ID.value}
+                    AND {Tables.SheetCatalog.value}.{SheetCatalogColumns.SHEET.value} = {Tables.FileFilter.value}.{FileFilterColumns.SHEET.value}
+                    WHERE {Tables.FileFilter.value}.{FileFilterColumns.FILTER_ID.value}=?""",
+                (int(filter_id),),
+            )
+            row = c.fetchone()
+            if row is None:
+                return None
+
+            dtypes: List[str] = json.loads(row[0])
+            column: int = int(row[1])
+            return dtypes[column] if 0 <= column < len(dtypes) else None
+
     def get_sheets_filters(self, file_id, sheet) -> Optional[List[dict]]:
         # Return a json representing a list of filter data's
-        with self.cursor() as c:
+        with self.cursor(readonly=True) as c:
             c.execute(
-                f"""SELECT {FilterColumns.INPUT.value}, 
+                f"""SELECT {FilterColumns.ID.value},
+                    {FilterColumns.VERSION.value},
+                    {FilterColumns.INPUT.value}, 
                     {FilterColumns.METHOD.value}, 
                     {FilterColumns.ENABLED.value}, 
                     {Tables.FileFilter.value}.{FileFilterColumns.COLUMN.value}
@@ -254,9 +927,11 @@ class DB:
             )
 
             filters_data = []
-            for input, method, enabled, column in c.fetchall():
+            for filter_id, version, input, method, enabled, column in c.fetchall():
                 filters_data.append(
                     {
+                        "id": int(filter_id),
+                        "version": int(version or 0),
                         "input": input,
                         "method": method,
                         "enabled": enabled == 1,  # Convert to bool
@@ -267,7 +942,7 @@ class DB:
 
     def get_filters_at(self, file_id, sheet, column) -> Optional[List[dict]]:
         # Return a json representing a list of filter data's
-        with self.cursor() as c:
+        with self.cursor(readonly=True) as c:
             c.execute(
                 f"""SELECT {FilterColumns.ID.value}, 
                 {FilterColumns.INPUT.value}, 
@@ -298,6 +973,39 @@ class DB:
                 )
             return filters_data
 
+    def get_sheet_filters_by_column(self, file_id, sheet) -> Dict[int, List[dict]]:
+        # Return every filter of a sheet grouped by column, in one query
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {FilterColumns.ID.value}, 
+                {FilterColumns.INPUT.value}, 
+                {FilterColumns.METHOD.value}, 
+                {FilterColumns.ENABLED.value},
+                {Tables.FileFilter.value}.{FileFilterColumns.COLUMN.value}
+                FROM {Tables.Filter.value}
+                LEFT JOIN {Tables.FileFilter.value}
+                ON {Tables.Filter.value}.{FilterColumns.ID.value} = {Tables.FileFilter.value}.{FileFilterColumns.FILTER_ID.value}
+                WHERE {Tables.FileFilter.value}.{FileFilterColumns.FILE_ID.value}=? AND 
+                {Tables.FileFilter.value}.{FileFilterColumns.SHEET.value}=?
+                ORDER BY {Tables.FileFilter.value}.{FileFilterColumns.COLUMN.value}""",
+                (
+                    int(file_id),
+                    int(sheet),
+                ),
+            )
+
+            filters_data: Dict[int, List[dict]] = dict()
+            for filter_id, input, method, enabled, column in c.fetchall():
+                filters_data.setdefault(int(column), list()).append(
+                    {
+                        "id": int(filter_id),
+                        "input": input,
+                        "method": method,
+                        "enabled": enabled == 1,  # Convert to bool
+                    }
+                )
+            return filters_data
+
     def update_filter(
         self, filter_id, method: str, input: str, enabled: bool
     ) -> Tuple[bool, str]:
@@ -308,9 +1016,14 @@ class DB:
                     f"""UPDATE {Tables.Filter.value}
                     SET {FilterColumns.INPUT.value} = ?,
                         {FilterColumns.METHOD.value} = ?,
-                        {FilterColumns.ENABLED.value} = ?
+                        {FilterColumns.ENABLED.value} = ?,
+                        {FilterColumns.VERSION.value} = {FilterColumns.VERSION.value} + (
+                            CASE WHEN {FilterColumns.INPUT.value} IS ?
+                            AND {FilterColumns.METHOD.value} IS ? THEN 0 ELSE 1 END
+                        )
                     WHERE {FilterColumns.ID.value} = ?""",
-                    (input, method, enabled, int(filter_id)),
+                    # Only a new input or method changes which rows the filter matches
+                    (input, method, enabled, input, method, int(filter_id)),
                 )
 
                 if c.rowcount > 0:
@@ -338,23 +1051,43 @@ class DB:
     def update_file(
         self, file_id, filename: str, file: FileStorage
     ) -> Tuple[bool, str]:
-        # Update the file_blob in database at the given id
+        # Update the file contents in database at the given id
         filename = os.path.basename(filename)
         name, ext = os.path.splitext(filename)
-        with self.cursor() as c:
-            try:
+        hash, size, tmp_path = self.store.stage(file.stream)
+        try:
+            with self.cursor() as c:
+                c.execute(
+                    f"""SELECT {FileColumns.HASH.value} FROM {Tables.File.value}
+                    WHERE {FileColumns.ID.value} = ?""",
+                    (int(file_id),),
+                )
+                row = c.fetchone()
+                if row is None:
+                    self.store.discard(tmp_path)
+                    return False, "File not found"
+
                 c.execute(
                     f"""UPDATE {Tables.File.value}
                     SET {FileColumns.NAME.value} = ?,
                         {FileColumns.EXT.value} = ?,
-                        {FileColumns.BLOB.value} = ?
+                        {FileColumns.HASH.value} = ?,
+                        {FileColumns.VERSION.value} = {FileColumns.VERSION.value} + 1
                     WHERE {FileColumns.ID.value} = ?""",
-                    (name, ext, file.read(), int(file_id)),
+                    (name, ext, hash, int(file_id)),
                 )
+                # Reference the new contents before releasing the old, they may be equal
+                self.reference_blob(c, hash, size, tmp_path)
+                released: List[str] = self.release_blobs(c, [row[0]])
+                self.delete_sheets(c, file_id)  # Stale until re-ingested
+        except (Error, OSError) as e:
+            # Rolled back, the staged content isn't referenced
+            self.store.discard(tmp_path)
+            return False, f"Failed to update {name}: {e}"
 
-                return c.rowcount > 0, f"Updated {name} successfully"
-            except Error as e:
-                return False, f"Failed to update {name}: {e}"
+        self.delete_blobs(released)
+        self.notify_file_changed(file_id)
+        return True, f"Updated {name} successfully"
 
     def update_file_name(self, file_id, name) -> Tuple[bool, str]:
         # Update the file name and ext in database at the given id
@@ -373,33 +1106,227 @@ class DB:
 
     def delete_file(self, file_id) -> Tuple[bool, str]:
         # Delete file record matching id
-        with self.cursor() as c:
-            try:
+        try:
+            with self.cursor() as c:
+                c.execute(
+                    f"""SELECT {FileColumns.HASH.value} FROM {Tables.File.value}
+                    WHERE {FileColumns.ID.value} = ?""",
+                    (int(file_id),),
+                )
+                hashes: list = [hash for hash, *_ in c.fetchall()]
                 c.execute(
                     f"""DELETE FROM {Tables.File.value}
                     WHERE {FileColumns.ID.value} = ?""",
                     (int(file_id),),
                 )
+                deleted: int = c.rowcount
+                released: List[str] = self.release_blobs(c, hashes)
+                self.delete_sheets(c, file_id)
+        except Exception as e:
+            return False, "File deletion query failed"
 
-                if c.rowcount > 0:
-                    return True, "File deleted successfully"
-                return False, "File not found"
-            except Exception as e:
-                return False, "File deletion query failed"
+        self.delete_blobs(released)
+        self.notify_file_changed(file_id)
+        if deleted > 0:
+            return True, "File deleted successfully"
+        return False, "File not found"
 
     def delete_files_from_session(self) -> Tuple[bool, str]:
         # TODO: add sessionID parameter later to delete only ones related to current session
         # Delete all files from session
-        with self.cursor() as c:
-            try:
+        try:
+            with self.cursor() as c:
+                c.execute(
+                    f"""SELECT {FileColumns.HASH.value} FROM {Tables.File.value}"""
+                )
+                hashes: list = [hash for hash, *_ in c.fetchall()]
                 c.execute(f"""DELETE FROM {Tables.File.value}""")
+                deleted: int = c.rowcount
+                released: List[str] = self.release_blobs(c, hashes)
+                self.delete_sheets(c)
+        except Exception as e:
+            print(e)
+            return False, "File deletion query failed"
 
-                if c.rowcount > 0:
-                    return True, "Session files deleted successfully"
-                return False, "No files found in session to delete"
-            except Exception as e:
-                print(e)
-                return False, "File deletion query failed"
+        self.delete_blobs(released)
+        self.notify_file_changed(None)
+        if deleted > 0:
+            return True, "Session files deleted successfully"
+        return False, "No files found in session to delete"
+
+    def add_job(self, file_ids: List[int]) -> Optional[int]:
+        # Queue a background ingest job for the current version of each file
+        try:
+            with self.cursor() as c:
+                c.execute(
+                    f"""INSERT INTO {Tables.Job.value} ({JobColumns.CREATED.value})
+                    VALUES (?)""",
+                    (time.time(),),
+                )
+                job_id: int = c.lastrowid
+                c.executemany(
+                    f"""INSERT INTO {Tables.JobFile.value}
+                    ({JobFileColumns.JOB_ID.value},
+                    {JobFileColumns.FILE_ID.value},
+                    {JobFileColumns.VERSION.value},
+                    {JobFileColumns.STATUS.value})
+                    SELECT ?, {FileColumns.ID.value}, {FileColumns.VERSION.value}, ?
+                    FROM {Tables.File.value} WHERE {FileColumns.ID.value} = ?""",
+                    [
+                        (job_id, JobStatus.QUEUED.value, int(file_id))
+                        for file_id in file_ids
+                    ],
+                )
+                return int(job_id)
+        except Error as e:
+            print(f"Failed to queue job: {e}")
+            return None
+
+    def count_pending_jobs(self) -> int:
+        # Return the number of queued or running job files
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT COUNT(*) FROM {Tables.JobFile.value}
+                WHERE {JobFileColumns.STATUS.value} IN (?, ?)""",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            )
+            count, *_ = c.fetchone()
+            return int(count)
+
+    def get_pending_job(self, file_id) -> Optional[int]:
+        # Return the newest job still queued or running for a file, None if there's none
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT MAX({JobFileColumns.JOB_ID.value}) FROM {Tables.JobFile.value}
+                WHERE {JobFileColumns.FILE_ID.value}=? AND {JobFileColumns.STATUS.value} IN (?, ?)""",
+                (int(file_id), JobStatus.QUEUED.value, JobStatus.RUNNING.value),
+            )
+            job_id, *_ = c.fetchone()
+            return job_id
+
+    def claim_jobs(self, limit: int, owner: str, lease: float) -> List[dict]:
+        # Mark up to limit queued job files as running by owner until the lease
+        # time and return them, oldest first, with what a worker needs to parse them
+        with self.cursor() as c:
+            c.execute(
+                f"""SELECT {Tables.JobFile.value}.{JobFileColumns.JOB_ID.value},
+                    {Tables.JobFile.value}.{JobFileColumns.FILE_ID.value},
+                    {Tables.JobFile.value}.{JobFileColumns.VERSION.value},
+                    {Tables.File.value}.{FileColumns.HASH.value},
+                    {Tables.File.value}.{FileColumns.NAME.value},
+                    {Tables.File.value}.{FileColumns.EXT.value}
+                    FROM {Tables.JobFile.value}
+                    LEFT JOIN {Tables.File.value}
+                    ON {Tables.File.value}.{FileColumns.ID.value} = {Tables.JobFile.value}.{JobFileColumns.FILE_ID.value}
+                    WHERE {Tables.JobFile.value}.{JobFileColumns.STATUS.value} = ?
+                    ORDER BY {Tables.JobFile.value}.{JobFileColumns.JOB_ID.value}
+                    LIMIT ?""",
+                (JobStatus.QUEUED.value, int(limit)),
+            )
+            jobs: List[dict] = [
+                {
+                    "job_id": job_id,
+                    "file_id": file_id,
+                    "version": version,
+                    "hash": hash,
+                    "name": name,
+                    "ext": ext,
+                }
+                for job_id, file_id, version, hash, name, ext in c.fetchall()
+            ]
+            c.executemany(
+                f"""UPDATE {Tables.JobFile.value}
+                SET {JobFileColumns.STATUS.value} = ?,
+                    {JobFileColumns.OWNER.value} = ?,
+                    {JobFileColumns.LEASE.value} = ?
+                WHERE {JobFileColumns.JOB_ID.value} = ? AND {JobFileColumns.FILE_ID.value} = ?""",
+                [
+                    (
+                        JobStatus.RUNNING.value,
+                        owner,
+                        lease,
+                        job["job_id"],
+                        job["file_id"],
+                    )
+                    for job in jobs
+                ],
+            )
+            return jobs
+
+    def renew_leases(self, owner: str, lease: float) -> int:
+        # Extend the claims of owner's running job files until the lease time
+        with self.cursor() as c:
+            c.execute(
+                f"""UPDATE {Tables.JobFile.value} SET {JobFileColumns.LEASE.value} = ?
+                WHERE {JobFileColumns.OWNER.value} = ? AND {JobFileColumns.STATUS.value} = ?""",
+                (lease, owner, JobStatus.RUNNING.value),
+            )
+            return c.rowcount
+
+    def finish_job(
+        self,
+        job_id: int,
+        file_id: int,
+        owner: str,
+        status: JobStatus,
+        error: str = None,
+    ) -> bool:
+        # Record the outcome of a job file, False if owner's claim on it was lost
+        # (its lease expired and the file was requeued)
+        with self.cursor() as c:
+            c.execute(
+                f"""UPDATE {Tables.JobFile.value}
+                SET {JobFileColumns.STATUS.value} = ?,
+                    {JobFileColumns.ERROR.value} = ?,
+                    {JobFileColumns.LEASE.value} = NULL
+                WHERE {JobFileColumns.JOB_ID.value} = ? AND {JobFileColumns.FILE_ID.value} = ?
+                AND {JobFileColumns.OWNER.value} = ? AND {JobFileColumns.STATUS.value} = ?""",
+                (
+                    status.value,
+                    error,
+                    int(job_id),
+                    int(file_id),
+                    owner,
+                    JobStatus.RUNNING.value,
+                ),
+            )
+            return c.rowcount > 0
+
+    def requeue_expired_jobs(self, now: float) -> int:
+        # Put running job files whose lease expired (their process died or hung)
+        # back in the queue. Claims from before leases existed have none.
+        with self.cursor() as c:
+            c.execute(
+                f"""UPDATE {Tables.JobFile.value}
+                SET {JobFileColumns.STATUS.value} = ?,
+                    {JobFileColumns.OWNER.value} = NULL,
+                    {JobFileColumns.LEASE.value} = NULL
+                WHERE {JobFileColumns.STATUS.value} = ?
+                AND ({JobFileColumns.LEASE.value} IS NULL OR {JobFileColumns.LEASE.value} < ?)""",
+                (JobStatus.QUEUED.value, JobStatus.RUNNING.value, now),
+            )
+            return c.rowcount
+
+    def get_job(self, job_id) -> Optional[List[dict]]:
+        # Return the status of every file of a job, None if the job doesn't exist
+        with self.cursor(readonly=True) as c:
+            c.execute(
+                f"""SELECT {JobFileColumns.FILE_ID.value},
+                    {JobFileColumns.STATUS.value},
+                    {JobFileColumns.ERROR.value}
+                    FROM {Tables.JobFile.value}
+                    WHERE {JobFileColumns.JOB_ID.value}=?
+                    ORDER BY {JobFileColumns.FILE_ID.value}""",
+                (int(job_id),),
+            )
+            rows = c.fetchall()
+            if not rows:
+                return None
+
+            return [
+                {"fileId": file_id, "status": status, "error": error}
+                for file_id, status, error in rows
+            ]
 
 
 def init_db(parent: os.PathLike, db_name: str) -> os.PathLike:
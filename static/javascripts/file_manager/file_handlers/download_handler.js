@@ -4,13 +4,7 @@ function handleDownload(dataId) {
 
     const data = JSON.stringify({ fileId: dataId });
 
-    fetch("/files/get/download", {
-        method: "POST",
-        headers: {
-            "Content-Type": "application/json"
-        },
-        body: data
-    })
+    fetch(`/files/get/download?${new URLSearchParams({ fileId: dataId })}`)
         .then(response => {
             if (!response.ok)
                 throw new Error("Server did not find file");
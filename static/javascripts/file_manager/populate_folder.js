@@ -3,34 +3,31 @@ import { initTooltipTriggerEl } from "/scripts/tooltip/tooltipHandler.js";
 const folderDiv = document.getElementById('drop-zone');
 
 export function addFiles(passedIds) {
-    Array.from(passedIds).forEach(id => {
-        const data = JSON.stringify({ fileId: id });
-        fetch("/files/get/name", {
-            method: "POST",
-            headers: {
-                "Content-Type": "application/json",
-            },
-            body: data
+    // Fetch the names of every file in a single request
+    const data = JSON.stringify({ fileIds: Array.from(passedIds) });
+    fetch("/files/get/names", {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+        },
+        body: data
+    })
+        .then(response => {
+            if (!response.ok)
+                throw new Error("Server did not respond");
+
+            return response.json();
         })
-            .then(response => {
-                if (!response.ok)
-                    throw new Error("Server did not respond");
-
-                return response.json();
-            })
-            .then(json => {
-                if (!json.hasOwnProperty("name") || !json.hasOwnProperty("ext"))
-                    throw new Error("Name or ext keys are missing from response");
-
-                return { name: json.name, ext: json.ext };
-            })
-            .then(({ name, ext }) => {
+        .then(json => {
+            if (!json.hasOwnProperty("files"))
+                throw new Error("Files key is missing from response");
+
+            json.files.forEach(({ id, name, ext }) => {
                 addFileView(name, id);
                 console.log(`Added file view for ${name + ext}`);
-            })
-            .catch(error => console.error(error))
-
-    });
+            });
+        })
+        .catch(error => console.error(error))
 }
 
 // Function to truncate text
@@ -103,6 +103,9 @@ function addFilter(filterView, column) {
         body: JSON.stringify(data),
     })
         .then(response => {
+            if (response.status === 400)
+                return rejectInput(response, filterView);  // e.g. text for a numeric range
+
             if (!response.ok)
                 throw new Error("Server did not respond");
 
@@ -140,6 +143,9 @@ function updateFilter(filterView, filterId) {
         body: JSON.stringify(data),
     })
         .then(response => {
+            if (response.status === 400)
+                return rejectInput(response, filterView);  // e.g. text for a numeric range
+
             if (!response.ok)
                 throw new Error("Server did not respond");
 
@@ -150,6 +156,15 @@ function updateFilter(filterView, filterId) {
         .catch(error => console.error(error));
 }
 
+function rejectInput(response, filterView) {
+    // Tell why the server refused the filter and let it be submitted again once fixed
+    return response.json().then(json => {
+        alert(json.error);
+        filterView.querySelector('button[name="filter-submit-button"]').classList.remove("disabled");
+        throw new Error(json.error);
+    });
+}
+
 // Toggling visibility
 function toggleVisibilityIcon(visibilityImg) {
     if (visibilityImg.classList.contains('toggled'))
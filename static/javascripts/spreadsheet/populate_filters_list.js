@@ -29,6 +29,28 @@ export function isFilterPopulated(column) {
     );
 }
 
+export function getSheetFilters() {
+    // Fetch every filter of the open sheet in a single request, grouped by column
+    const fileId = document.getElementById('spreadsheet').getAttribute('data-id');
+    const sheet = getSelectedSheetIndex();
+    const data = JSON.stringify({ fileId: fileId, sheet: sheet });
+
+    return fetch("/filters/get/sheet", {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+        },
+        body: data
+    })
+        .then(response => {
+            if (!response.ok)
+                throw new Error("Server couldn't find filters for specified sheet");
+
+            return response.json();
+        })
+        .then(json => json.columns);
+}
+
 // Helper methods
 function positionPopup(target, popup) {
     // Position popup at target
@@ -84,6 +106,59 @@ function getFiltersFromDB(column) {
         .catch(error => console.error(error));
 }
 
+function getColumnStats(column) {
+    // Most frequent values, null count and value range of the column, to suggest inputs
+    const fileId = document.getElementById('spreadsheet').getAttribute('data-id');
+    const sheet = getSelectedSheetIndex();
+    const data = JSON.stringify({ fileId: fileId, sheet: sheet, columns: [column] });
+
+    return fetch("/files/get/sheet/stats", {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json",
+        },
+        body: data
+    })
+        .then(response => {
+            if (!response.ok)
+                throw new Error("Server couldn't compute statistics for specified column");
+
+            return response.json();
+        })
+        .then(json => json.columns ? json.columns[0] : null)
+        .catch(error => {
+            console.error(error);
+            return null;  // The popup works without suggestions
+        });
+}
+
+function addColumnStats(container, stats) {
+    // Offer the column's most frequent values in every filter input, summarize the rest
+    const suggestions = document.createElement('datalist');
+    suggestions.id = 'filter-suggestions';
+    stats.values.forEach(({ value, count }) => {
+        const option = document.createElement('option');
+        option.value = value;
+        option.label = `${count}×`;
+        suggestions.appendChild(option);
+    });
+    container.appendChild(suggestions);
+
+    const parts = [`${stats.distinct} distinct`, `${stats.nulls} empty`];
+    if (stats.min !== null)
+        parts.push(`${stats.min} – ${stats.max}`);
+
+    const summary = document.createElement('div');
+    summary.classList.add('column-stats');
+    summary.textContent = parts.join(' · ');
+    container.insertBefore(summary, container.firstChild);
+}
+
+function suggestInputs(element) {
+    // Link filter inputs to the suggestions of the open popup
+    element.querySelectorAll('input[name="filter-input"]').forEach(input => input.setAttribute('list', 'filter-suggestions'));
+}
+
 // Handle pop up closing
 export function closePopup() {
     // Create popup at view target
@@ -131,9 +206,13 @@ function createPopup(column) {
 
         filtersList.setAttribute('data-column', column);
 
-        const filters = await getFiltersFromDB(column);
+        const [filters, stats] = await Promise.all([getFiltersFromDB(column), getColumnStats(column)]);
         await populateFilterList(filtersList, filters);
         addSeparators(filtersList);
+        if (stats) {
+            addColumnStats(container, stats);
+            suggestInputs(filtersList);
+        }
         resolve(container); // Resolve the promise after popup creation
     });
 }
@@ -192,6 +271,7 @@ function addNewFilterView(container, column) {
         const filterItemView = document.createElement('div');
         filterItemView.classList.add("filter-item");
         filterItemView.innerHTML = content;
+        suggestInputs(filterItemView);
         // Don't add data-id until it is added to DB
 
         handleFilter(filterItemView, column);
@@ -1,4 +1,4 @@
-import { viewFilterList, closePopup, isFilterPopulated } from "/scripts/spreadsheet/populate_filters_list.js"
+import { viewFilterList, closePopup, getSheetFilters } from "/scripts/spreadsheet/populate_filters_list.js"
 import { adjustSpinner, getSelectedSheetIndex } from "/scripts/spreadsheet/sheet_selector_handler.js";
 import { initTooltipTriggerEl } from "/scripts/tooltip/tooltipHandler.js";
 
@@ -22,6 +22,36 @@ function preloadImages(imageStates) {
 
 const spreadsheetElement = document.getElementById('spreadsheet');
 
+// Server-side sort of each opened sheet, "fileId:sheet" -> [{ column, descending }]
+const sheet_sorts = new Map();
+
+function getSheetSort() {
+    const key = `${spreadsheetElement.getAttribute('data-id')}:${getSelectedSheetIndex()}`;
+    if (!sheet_sorts.has(key))
+        sheet_sorts.set(key, []);
+    return sheet_sorts.get(key);
+}
+
+function toggleSort(column, add) {
+    // Cycle a column through ascending, descending and unsorted. Without add (shift
+    // click) it becomes the only sort key, with it a further key.
+    const sort = getSheetSort();
+    const index = sort.findIndex(key => key.column === column);
+    const current = index === -1 ? null : sort[index];
+
+    if (!add)
+        sort.splice(0, sort.length, ...(current ? [current] : []));
+
+    if (!current)
+        sort.push({ column: column, descending: false });
+    else if (!current.descending)
+        current.descending = true;
+    else
+        sort.splice(sort.indexOf(current), 1);
+
+    openSheet(getSelectedSheetIndex());
+}
+
 function updateSpreadsheetElement(sheet, editable = false) {
     // Convert sheet data to HTML with grid lines
     const html = XLSX.utils.sheet_to_html(sheet, { editable: editable, showGridLines: true });
@@ -34,6 +64,12 @@ function updateSpreadsheetElement(sheet, editable = false) {
     // Mark header rows as header-cell
     const firstRowCells = spreadsheetElement.querySelectorAll('tr:first-child td');
 
+    // Fetch the filters of every column at once instead of one request per cell
+    const sheetFilters = getSheetFilters().catch(error => {
+        console.error(error);
+        return {};
+    });
+
     return new Promise((resolve, reject) => {
         const content = sessionStorage.getItem("headerCellTemplate");
         if (content === null)
@@ -45,13 +81,21 @@ function updateSpreadsheetElement(sheet, editable = false) {
             cell.classList.add('header-cell');
             cell.innerHTML = content;
 
-            cell.querySelector('div[name="cell-name"]').textContent = oldText;
+            const cellName = cell.querySelector('div[name="cell-name"]');
+            cellName.textContent = oldText;
+
+            // Sort by the column when its name is clicked, shift click to sort by several
+            const key = getSheetSort().find(key => key.column === cell.cellIndex);
+            if (key)
+                cellName.classList.add(key.descending ? 'sorted-desc' : 'sorted-asc');
+            cellName.addEventListener('click', (event) => toggleSort(cell.cellIndex, event.shiftKey));
 
             const cellFilterImg = cell.querySelector('img[name="cell-filter"]');
             initTooltipTriggerEl(cellFilterImg);
 
-            isFilterPopulated(cell.cellIndex).then(result => {
-                const state = result ? filter_states.populated : filter_states.empty
+            sheetFilters.then(filters => {
+                const populated = (filters[cell.cellIndex] || []).length > 0;
+                const state = populated ? filter_states.populated : filter_states.empty
                 cellFilterImg.src = state.url;
                 cellFilterImg.alt = state.alt;
             })
@@ -64,21 +108,52 @@ function updateSpreadsheetElement(sheet, editable = false) {
     });
 }
 
-// Fetch sheet and call to updateSpreadsheet
-export function openSheet(sheet_num) {
-    const data = { fileId: spreadsheetElement.getAttribute('data-id'), sheet: sheet_num };
+const PREVIEW_ROWS = 200;  // Rows shown while a large sheet is still being parsed
+const JOB_POLL_MS = 1000;
 
-    fetch('/files/get/sheet', {
+// Resolve once every file of a background parsing job is done
+function waitForJob(job_id) {
+    return fetch('/jobs/status', {
         method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify(data)
-    }).then(response => {
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ jobId: job_id }),
+    }).then(response => response.json()).then(status => {
+        if (status.done || status.error) {
+            return status;
+        }
+        return new Promise(resolve => setTimeout(resolve, JOB_POLL_MS)).then(() => waitForJob(job_id));
+    });
+}
+
+// Fetch sheet and call to updateSpreadsheet
+export function openSheet(sheet_num, preview = true) {
+    const file_id = spreadsheetElement.getAttribute('data-id');
+    const data = { fileId: file_id, sheet: sheet_num };
+    if (preview) {
+        data.preview = PREVIEW_ROWS;  // First rows right away if the sheet isn't parsed yet
+    }
+    const sort = getSheetSort();
+    if (sort.length > 0) {
+        data.sort = sort.map(key => key.descending ? `${key.column}:desc` : `${key.column}`).join(',');
+    }
+
+    // GET so the browser can revalidate its cached copy (ETag) instead of re-fetching
+    fetch(`/files/get/sheet?${new URLSearchParams(data)}`).then(response => {
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
 
+        if (response.headers.get('X-Preview') === 'incomplete') {
+            // Show the whole sheet once its parse finished, unless another one was opened meanwhile
+            const job_id = response.headers.get('X-Job-Id');
+            const parsed = job_id ? waitForJob(job_id) : Promise.resolve();
+            parsed.then(() => {
+                if (spreadsheetElement.getAttribute('data-id') === file_id && getSelectedSheetIndex() == sheet_num) {
+                    openSheet(sheet_num, false);
+                }
+            }).catch(error => console.error("Error while waiting for the sheet to be parsed :", error));
+        }
+
         return response.blob();  // Return the response as a blob
     }).then(blob => {
         const reader = new FileReader();
@@ -107,7 +182,7 @@ export function closeSpreadsheet() {
     console.log("Spreadsheet closed");
 }
 
-function openFile(id) {
+function openFile(id, retry = true) {
     const data = JSON.stringify({ fileId: id })
 
     fetch('/files/get/sheet_count', {
@@ -124,12 +199,23 @@ function openFile(id) {
             return response.json();
         })
         .then(json => {
+            if (json.pending && retry) {
+                // The sheets are only known once the file is parsed, try again then
+                return waitForJob(json.jobId).then(() => {
+                    openFile(id, false);
+                    return null;
+                });
+            }
+
             if (!json.hasOwnProperty('sheets'))
                 throw new Error("Sheet count was not included in response");
 
             return json.sheets;
         })
         .then(sheet_count => {
+            if (sheet_count === null)
+                return;
+
             spreadsheetElement.setAttribute('data-id', id);
             openSheet(0);  // Start at first sheet, sheets are 0-based indices
 
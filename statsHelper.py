@@ -0,0 +1,77 @@
+# Column statistics for the filter UI: distinct values, nulls and value ranges
+
+from __future__ import annotations
+
+import json
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+STATS_TOP_VALUES: int = 20  # Distinct values listed per column by default
+
+
+def jsonValue(value: Any) -> Any:
+    # A cell value as something jsonify can send
+    import pandas as pd
+
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        value = value.item()  # numpy scalar to its Python counterpart
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def columnStats(series: pd.Series, top: int = STATS_TOP_VALUES) -> dict:
+    # Null count, the top most frequent values with their counts and, for numeric
+    # and date columns, the minimum and maximum. Counted in one hash pass.
+    from pandas.api.types import (
+        is_bool_dtype,
+        is_datetime64_any_dtype,
+        is_numeric_dtype,
+    )
+
+    counts: pd.Series = series.value_counts(dropna=True, sort=True)
+    stats: dict = {
+        "dtype": str(series.dtype),
+        "nulls": int(len(series) - counts.sum()),
+        "distinct": len(counts),
+        "values": [
+            {"value": jsonValue(value), "count": int(count)}
+            for value, count in counts.iloc[:top].items()
+        ],
+        "truncated": len(counts) > top,
+        "min": None,
+        "max": None,
+    }
+
+    ranged: bool = (
+        is_numeric_dtype(series.dtype) and not is_bool_dtype(series.dtype)
+    ) or is_datetime64_any_dtype(series.dtype)
+    if ranged and len(counts):
+        # The distinct values are far fewer than the rows on repetitive columns
+        stats["min"] = jsonValue(counts.index.min())
+        stats["max"] = jsonValue(counts.index.max())
+
+    return stats
+
+
+def sizeOfStats(stats: dict) -> int:
+    # Approximate size in bytes of cached statistics, by their JSON encoding
+    return len(json.dumps(stats))
+
+
+def sheetStats(
+    df: pd.DataFrame, columns: Optional[list] = None, top: int = STATS_TOP_VALUES
+) -> list:
+    # Statistics of each df column, labeled with its sheet column position.
+    # columns lists the sheet column of each df column when df is a projection.
+    positions: list = list(range(df.shape[1])) if columns is None else columns
+    return [
+        {"column": position, "name": str(name), **columnStats(df.iloc[:, index], top)}
+        for index, (position, name) in enumerate(zip(positions, df.columns))
+    ]
@@ -0,0 +1,21 @@
+# Tests import the app's modules from the repository root
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A test client of the app on a database of its own, with its ingest queue
+    # stopped so uploaded files stay queued
+    monkeypatch.setenv("APP_FOLDER", str(tmp_path))
+    import app
+
+    flask_app = app.create_app()
+    app.ingest_queue.stop()
+    yield flask_app.test_client()
+    app.offload.shutdown()
+    app.db.close()
@@ -0,0 +1,80 @@
+# Failed writes roll back entirely, and stored contents are only deleted once
+# the transaction releasing them committed
+
+import os
+import sqlite3
+from io import BytesIO
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from sqlHelper import DB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DB(os.path.join(tmp_path, "files.db"))
+    yield db
+    db.close()
+
+
+def upload(content: bytes, filename: str = "data.csv") -> FileStorage:
+    return FileStorage(BytesIO(content), filename=filename)
+
+
+def count(db: DB, table: str) -> int:
+    with db.cursor(readonly=True) as c:
+        c.execute(f"SELECT COUNT(*) FROM {table}")
+        return c.fetchone()[0]
+
+
+def failing(error: Exception):
+    def fail(*args, **kwargs):
+        raise error
+
+    return fail
+
+
+def test_add_file_rolls_back_when_the_store_fails(db, monkeypatch):
+    monkeypatch.setattr(db.store, "commit", failing(OSError("disk full")))
+
+    ok, msg, file_id = db.add_file("data.csv", upload(b"a,b\n1,2\n"))
+    assert not ok and file_id is None
+    assert count(db, "File") == 0 and count(db, "Blob") == 0
+    assert os.listdir(db.store.tmp_dir) == []
+
+
+def test_add_files_rolls_back_when_the_store_fails(db, monkeypatch):
+    monkeypatch.setattr(db.store, "commit", failing(OSError("disk full")))
+
+    results: list = db.add_files([upload(b"a\n1\n"), upload(b"b\n2\n")])
+    assert [ok for ok, *_ in results] == [False, False]
+    assert count(db, "File") == 0 and count(db, "Blob") == 0
+
+
+def test_update_file_keeps_the_old_contents_on_rollback(db, monkeypatch):
+    ok, _, file_id = db.add_file("data.csv", upload(b"old\n"))
+    old_hash: str = db.get_file_hash(file_id)
+
+    monkeypatch.setattr(
+        db, "delete_sheets", failing(sqlite3.OperationalError("locked"))
+    )
+    ok, _ = db.update_file(file_id, "data.csv", upload(b"new\n"))
+    assert not ok
+
+    assert db.get_file_hash(file_id) == old_hash
+    assert db.store.exists(old_hash)
+    assert count(db, "Blob") == 1
+
+
+def test_deleted_contents_are_removed_unless_shared(db):
+    _, _, first = db.add_file("a.csv", upload(b"shared\n"))
+    _, _, second = db.add_file("b.csv", upload(b"shared\n"))
+    hash: str = db.get_file_hash(first)
+
+    assert db.delete_file(first)[0]
+    assert db.store.exists(hash)
+
+    assert db.delete_file(second)[0]
+    assert not db.store.exists(hash)
+    assert count(db, "Blob") == 0
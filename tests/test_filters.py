@@ -0,0 +1,332 @@
+# The single-pass applyFilters, with and without its caches, must filter exactly like
+# the original one-filter-at-a-time implementation on seeded random frames, and
+# range filters and sorts exactly like pandas comparisons and sort_values
+
+import random
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cacheHelper import FilterCache
+from helperMethods import (
+    FILTER_METHODS,
+    RANGE_METHODS,
+    SortedColumn,
+    applyFilters,
+    compileFilter,
+    rangeKind,
+    validateFilter,
+)
+
+WORDS: list = ["open", "closed", "a.b", "a+b", "x(y)", "", "Open", "ab", "1.0", "nan"]
+# Regex metacharacters, numbers as str, date prefixes and str forms of missing values
+INPUTS: list = WORDS + [
+    "1",
+    "2.5",
+    "0.5",
+    "^o",
+    "a.",
+    "[ab]",
+    "2024-01-0",
+    "None",
+    "NaT",
+]
+METHODS: list = ["exact", "contains", "not contains", "regex"]
+
+
+def escapeRegEx(regEx: str) -> str:
+    return re.sub(r"[.*+?^${}()|[\]\\]", r"\\\g<0>", regEx)
+
+
+def legacyApplyFilters(df: pd.DataFrame, filters: list) -> pd.DataFrame:
+    # applyFilters before filters were compiled into a plan
+    new_df: pd.DataFrame = df.copy()
+    for filter in filters:
+        inp, method, column, enabled = (
+            filter["input"],
+            filter["method"],
+            filter["column"],
+            filter["enabled"],
+        )
+
+        if not enabled:
+            continue
+
+        column_name = new_df.columns[column]
+
+        if method != "regex":
+            inp = escapeRegEx(inp)
+
+        if method == "exact":
+            new_df = new_df[new_df[column_name].astype(str).eq(inp)]
+        elif method == "contains":
+            new_df = new_df[new_df[column_name].astype(str).str.contains(inp)]
+        elif method == "not contains":
+            new_df = new_df[~new_df[column_name].astype(str).str.contains(inp)]
+        elif method == "regex":
+            new_df = new_df[new_df[column_name].astype(str).str.match(inp)]
+        else:
+            raise ValueError("Unsupported method")
+
+    return new_df
+
+
+def randomFrame(rng: np.random.Generator, rows: int) -> pd.DataFrame:
+    # str, int, float with NaN, mixed object with None and datetime columns
+    return pd.DataFrame(
+        {
+            "s": rng.choice(WORDS, rows),
+            "i": rng.integers(0, 20, rows),
+            "f": np.where(rng.random(rows) < 0.2, np.nan, rng.integers(0, 5, rows) / 2),
+            "o": pd.Series(
+                rng.choice(WORDS + [1, 2.5, None], rows).tolist(), dtype=object
+            ),
+            "d": pd.Timestamp("2024-01-01")
+            + pd.to_timedelta(rng.integers(0, 5, rows), unit="D"),
+        }
+    )
+
+
+def randomFilters(picker: random.Random, columns: int) -> list:
+    return [
+        {
+            "id": id,
+            "version": 0,
+            "input": picker.choice(INPUTS),
+            "method": picker.choice(METHODS),
+            "column": picker.randrange(columns),
+            "enabled": picker.random() < 0.8,
+        }
+        for id in range(picker.randint(0, 4))
+    ]
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_matches_legacy(seed: int):
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    for _ in range(4):
+        df: pd.DataFrame = randomFrame(rng, picker.randint(0, 60))
+        filters: list = randomFilters(picker, df.shape[1])
+
+        pd.testing.assert_frame_equal(
+            applyFilters(df, filters), legacyApplyFilters(df, filters)
+        )
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_cached_matches_legacy(seed: int):
+    # Evaluated twice: the second run re-uses the cached masks and encodings
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    for file_id in range(4):
+        df: pd.DataFrame = randomFrame(rng, picker.randint(0, 60))
+        filters: list = randomFilters(picker, df.shape[1])
+        expected: pd.DataFrame = legacyApplyFilters(df, filters)
+
+        cache = FilterCache(1024 * 1024, 1024 * 1024, 1024 * 1024)
+        for _ in range(2):
+            pd.testing.assert_frame_equal(
+                applyFilters(df, filters, cache, (file_id, 0, 0)), expected
+            )
+
+
+NUMBERS: list = ["0", "1", "2.5", " 3 ", "-1", "10", "1e1", "19"]
+DATES: list = ["2024-01-01", "2024-01-02 12:00", "2024-01-03", "2023-12-31", "2024-02"]
+
+
+def rangeFrame(rng: np.random.Generator, rows: int) -> pd.DataFrame:
+    # randomFrame with missing dates too
+    df: pd.DataFrame = randomFrame(rng, rows)
+    df["d"] = df["d"].where(rng.random(rows) > 0.2)
+    return df
+
+
+def randomBound(picker: random.Random, series: pd.Series) -> str:
+    kind: str = rangeKind(series.dtype)
+    if kind == "number":
+        return picker.choice(NUMBERS)
+    if kind == "date":
+        return picker.choice(DATES)
+    return picker.choice(INPUTS)
+
+
+def comparable(series: pd.Series, bound: str):
+    # The column's values and a bound as pandas compares them for a range filter
+    kind: str = rangeKind(series.dtype)
+    if kind == "number":
+        return series.astype(float), float(bound)
+    if kind == "date":
+        return series, pd.Timestamp(bound.strip())
+    return series.astype(str), bound.strip()
+
+
+def expectedRange(series: pd.Series, filter: dict) -> np.ndarray:
+    method, inp = filter["method"], filter["input"]
+    low, high = inp.split(",") if method == "between" else (None, None)
+    if method == ">":
+        low = inp
+    elif method == "<":
+        high = inp
+
+    mask: pd.Series = series.notna()
+    if low is not None:
+        values, bound = comparable(series, low)
+        mask &= values >= bound if method == "between" else values > bound
+    if high is not None:
+        values, bound = comparable(series, high)
+        mask &= values <= bound if method == "between" else values < bound
+    return mask.to_numpy(dtype=bool)
+
+
+def randomRangeFilters(picker: random.Random, df: pd.DataFrame) -> list:
+    filters: list = list()
+    for id in range(picker.randint(1, 3)):
+        column: int = picker.randrange(df.shape[1])
+        method: str = picker.choice(RANGE_METHODS)
+        inp: str = randomBound(picker, df.iloc[:, column])
+        if method == "between":
+            inp += "," + randomBound(picker, df.iloc[:, column])
+        filters.append(
+            {
+                "id": id,
+                "version": 0,
+                "input": inp,
+                "method": method,
+                "column": column,
+                "enabled": True,
+            }
+        )
+    return filters
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_range_filters_match_pandas(seed: int):
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    for file_id in range(4):
+        df: pd.DataFrame = rangeFrame(rng, picker.randint(0, 60))
+        filters: list = randomRangeFilters(picker, df)
+
+        mask: np.ndarray = np.ones(len(df), dtype=bool)
+        for filter in filters:
+            series: pd.Series = df.iloc[:, filter["column"]]
+            expected: np.ndarray = expectedRange(series, filter)
+            predicate = compileFilter(filter)
+            np.testing.assert_array_equal(predicate(SortedColumn(series)), expected)
+            mask &= expected
+
+        cache = FilterCache(1024 * 1024, 1024 * 1024, 1024 * 1024)
+        pd.testing.assert_frame_equal(applyFilters(df, filters), df[mask])
+        for _ in range(2):
+            pd.testing.assert_frame_equal(
+                applyFilters(df, filters, cache, (file_id, 0, 0)), df[mask]
+            )
+
+
+def sortable(series: pd.Series) -> pd.Series:
+    # The column as sorts compare it: text by its str value, nulls kept missing
+    if rangeKind(series.dtype) == "text":
+        return series.astype(str).where(series.notna(), None)
+    return series
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_sort_matches_pandas(seed: int):
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    for file_id in range(4):
+        df: pd.DataFrame = rangeFrame(rng, picker.randint(0, 60))
+        # Few distinct values, so later keys break ties
+        df["i"] = df["i"] % 3
+        sort: list = [
+            (column, picker.random() < 0.5)
+            for column in picker.sample(range(df.shape[1]), picker.randint(1, 3))
+        ]
+
+        keys: pd.DataFrame = pd.DataFrame(
+            {
+                index: sortable(df.iloc[:, column])
+                for index, (column, _) in enumerate(sort)
+            }
+        )
+        order = keys.sort_values(
+            by=list(keys.columns),
+            ascending=[not descending for _, descending in sort],
+            na_position="last",
+            kind="stable",
+        ).index
+        expected: pd.DataFrame = df.loc[order]
+
+        cache = FilterCache(1024 * 1024, 1024 * 1024, 1024 * 1024)
+        pd.testing.assert_frame_equal(applyFilters(df, [], sort=sort), expected)
+        for _ in range(2):
+            pd.testing.assert_frame_equal(
+                applyFilters(df, [], cache, (file_id, 0, 0), sort=sort), expected
+            )
+
+        # Sorting and filtering at once keeps the sorted order of the passing rows
+        filters: list = randomRangeFilters(picker, df)
+        filtered: pd.DataFrame = applyFilters(df, filters)
+        pd.testing.assert_frame_equal(
+            applyFilters(df, filters, sort=sort),
+            expected[expected.index.isin(filtered.index)],
+        )
+
+
+@pytest.mark.parametrize(
+    "method, inp, dtype, error",
+    [
+        ("fuzzy", "a", None, "Unsupported method 'fuzzy'"),
+        ("regex", "(", None, "Invalid regex"),
+        ("regex", "^o", "object", None),
+        ("contains", "(", "object", None),
+        ("between", "1", "int64", "Between needs two values separated by a comma"),
+        (">", "abc", "float64", "'abc' is not a number"),
+        ("between", "1,abc", "int64", "'abc' is not a number"),
+        ("<", "2024-13-45", "datetime64[ns]", "'2024-13-45' is not a date"),
+        ("between", "2024-01-01,2024-02", "datetime64[ns]", None),
+        (">", "abc", "object", None),
+        (">", "abc", None, None),
+        ("<", " 2.5 ", "float64", None),
+        # Missing values compare false with everything, they aren't bounds
+        ("<", "nan", "float64", "'nan' is not a number"),
+        (">", "NaT", "datetime64[ns]", "'NaT' is not a date"),
+        ("between", ",2024-01-01", "datetime64[ns]", "'' is not a date"),
+    ],
+)
+def test_validate_filter(method: str, inp: str, dtype, error):
+    message = validateFilter(method, inp, dtype)
+    if error is None:
+        assert message is None
+    else:
+        assert message is not None and message.startswith(error)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_validate_filter_accepts_what_applies(seed: int):
+    # validateFilter accepts exactly the filters that compile and evaluate on a
+    # column of the dtype
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    df: pd.DataFrame = rangeFrame(rng, 30)
+    for _ in range(50):
+        column: int = picker.randrange(df.shape[1])
+        series: pd.Series = df.iloc[:, column]
+        method: str = picker.choice(FILTER_METHODS)
+        inp: str = picker.choice(INPUTS + NUMBERS + DATES + ["1,2", "2024-01-01,x"])
+        filter: dict = {"input": inp, "method": method, "column": column}
+
+        try:
+            predicate = compileFilter(filter)
+            if method in RANGE_METHODS:
+                predicate(SortedColumn(series))
+            else:
+                predicate(series.astype(str))
+            applies: bool = True
+        except (ValueError, re.error):
+            applies = False
+
+        assert (validateFilter(method, inp, str(series.dtype)) is None) == applies
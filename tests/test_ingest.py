@@ -0,0 +1,77 @@
+# Files are parsed by the background ingest queue, requests only read their previews
+
+import time
+from io import BytesIO
+
+import pandas as pd
+
+from sqlHelper import JobStatus
+
+
+def workbook(sheets: int, rows: int) -> bytes:
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for sheet in range(sheets):
+            frame = pd.DataFrame({"id": range(rows), "value": [sheet] * rows})
+            frame.to_excel(writer, sheet_name=f"Sheet{sheet}", index=False)
+    return output.getvalue()
+
+
+def upload(client, data: bytes, filename: str) -> dict:
+    response = client.post("/files/upload", data={"file": (BytesIO(data), filename)})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_sheet_count_leaves_the_parse_queued(client):
+    uploaded: dict = upload(client, workbook(3, 500), "book.xlsx")
+    file_id, job_id = uploaded["passed"][0], uploaded["jobId"]
+
+    response = client.post("/files/get/sheet_count", json={"fileId": file_id})
+    assert response.status_code == 200
+    assert response.get_json() == {"sheets": 3, "jobId": job_id}
+
+    with client.get(
+        "/files/get/sheet", query_string={"fileId": file_id, "sheet": 0, "preview": 200}
+    ) as preview:
+        assert preview.status_code == 200
+        assert preview.headers["X-Preview"] == "incomplete"
+        assert preview.headers["X-Job-Id"] == str(job_id)
+
+    status: dict = client.post("/jobs/status", json={"jobId": job_id}).get_json()
+    assert [file["status"] for file in status["files"]] == ["queued"]
+
+
+def test_schema_is_pending_until_parsed(client):
+    uploaded: dict = upload(client, workbook(1, 10), "book.xlsx")
+    file_id, job_id = uploaded["passed"][0], uploaded["jobId"]
+
+    response = client.post("/files/get/schema", json={"fileId": file_id})
+    assert response.status_code == 202
+    assert response.get_json() == {"pending": True, "jobId": job_id}
+
+
+def test_claims_are_only_requeued_once_their_lease_expired(client):
+    import app
+
+    job_id: int = upload(client, workbook(1, 10), "book.xlsx")["jobId"]
+    now: float = time.time()
+    (task,) = app.db.claim_jobs(1, "first", now + 30)
+
+    # Another process starting up leaves the running claim alone
+    assert app.db.requeue_expired_jobs(now) == 0
+    assert app.db.claim_jobs(1, "second", now + 30) == []
+
+    assert app.db.renew_leases("first", now + 60) == 1
+    assert app.db.requeue_expired_jobs(now + 45) == 0
+
+    # Its process stopped renewing: requeued and claimed by another one
+    assert app.db.requeue_expired_jobs(now + 61) == 1
+    assert [
+        claimed["file_id"] for claimed in app.db.claim_jobs(1, "second", now + 90)
+    ] == [task["file_id"]]
+    assert not app.db.finish_job(job_id, task["file_id"], "first", JobStatus.DONE)
+    assert app.db.finish_job(job_id, task["file_id"], "second", JobStatus.DONE)
+
+    status: dict = client.post("/jobs/status", json={"jobId": job_id}).get_json()
+    assert status["done"]
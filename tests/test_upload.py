@@ -0,0 +1,41 @@
+# Uploaded files are accepted by their contents, text files in any encoding the
+# csv reader detects
+
+from io import BytesIO
+
+import pytest
+
+TEXT: str = "name,city\nAnna,Zürich\nBo,東京\n"
+
+
+def upload(client, data: bytes, filename: str) -> dict:
+    response = client.post("/files/upload", data={"file": (BytesIO(data), filename)})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.mark.parametrize(
+    "encoding", ["utf-8", "utf-8-sig", "utf-16", "utf-16-le", "utf-16-be", "utf-32"]
+)
+def test_csv_encodings(client, encoding: str):
+    uploaded: dict = upload(client, TEXT.encode(encoding), "cities.csv")
+    assert uploaded["results"][0]["ok"], uploaded["results"][0]["message"]
+
+    with client.get(
+        "/files/get/sheet",
+        query_string={"fileId": uploaded["passed"][0], "sheet": 0, "preview": 10},
+        headers={"Accept": "application/json"},
+    ) as response:
+        assert response.status_code == 200
+        assert response.get_json() == {
+            "columns": ["name", "city"],
+            "data": [["Anna", "Bo"], ["Zürich", "東京"]],
+        }
+
+
+def test_binary_csv_rejected(client):
+    uploaded: dict = upload(client, bytes(range(256)) * 16, "binary.csv")
+    assert uploaded["passed"] == []
+    assert (
+        uploaded["results"][0]["message"] == "Contents don't match the .csv extension"
+    )